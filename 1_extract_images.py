@@ -1,39 +1,156 @@
+import io
 import os
+import sys
 import glob
-from pikepdf import Pdf, PdfImage
-from constants import IMAGES_DIRECTORY
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pdf_images import get_year, get_folder_name, get_page_categories, get_page_images, get_chart_images, \
+    get_image_name
 from settings import PDFS_FOLDER_NAME, EXTRACT_ALL_IMAGES
 
-if not os.path.exists(PDFS_FOLDER_NAME):
-    os.mkdir(PDFS_FOLDER_NAME)
+"""
+Subject reports are decoded in a pool of processes (pikepdf holds the GIL while decoding)
+and the images are written by a pool of threads, so several reports are in progress at once.
+At most max_pending reports are decoded but not yet written at any time, which caps the memory used.
+"""
 
 
-for filename in glob.glob(f"{PDFS_FOLDER_NAME}/*.pdf"):
+def prepare_folder(filename: str, overwrite: bool = False) -> str:
+    """
+    Gets the folder which the charts of a subject report are extracted to. Returns None if it should be skipped.
+    The folder itself is only made by write_images, once the charts have been decoded
+    """
+    folder_name = get_folder_name(filename)
+    if os.path.exists(folder_name) and not overwrite:   # skip if subject has already been analysed
+        print(f"Skipping {filename} since folder {folder_name} already exists.")
+        return None
+    return folder_name
+
+
+def decode_pdf(filename: str) -> list:
+    """Decodes the charts of a subject report. Returns a list of (image name, file extension, encoded image)"""
+    from pikepdf import Pdf     # only imported where the reports are decoded (i.e. in the worker processes)
+    images = []
+    with Pdf.open(filename) as pdf:
+        if EXTRACT_ALL_IMAGES:
+            pdf_images = get_page_images(pdf, get_page_categories(pdf, get_year(filename)))
+        else:
+            # Only the charts found by the index are decoded
+            pdf_images = get_chart_images(filename, pdf)
+
+        for graph_type, page_number, image_index, image in pdf_images:
+            stream = io.BytesIO()
+            extension = image.extract_to(stream=stream)
+            images.append((get_image_name(graph_type, page_number, image_index), extension, stream.getvalue()))
+    return images
+
+
+def write_images(folder_name: str, images: list):
+    """
+    Writes the charts of a subject report into a hidden temporary folder first, which then replaces its folder,
+    so that a report which failed part way never leaves a folder behind (which would be skipped by the next run)
+    """
+    parent_folder, subject_folder = os.path.split(folder_name)
+    temporary_folder = os.path.join(parent_folder, f".{subject_folder}.tmp")   # hidden folders aren't analysed
+    shutil.rmtree(temporary_folder, ignore_errors=True)
+    os.makedirs(temporary_folder)
     try:
-        year = int("20" + filename[filename.index("_subj_rpt") - 2: filename.index("_subj_rpt")])
-        folder_name = filename.replace("snr_", "").replace("_subj_rpt", "").replace(".pdf", "")
-        if os.path.exists(folder_name):   # skip if subject has already been analysed
-            print(f"Skipping {filename} since folder {folder_name} already exists.")
-            continue
-        os.mkdir(folder_name)     # [:-4] removes the .pdf ending
-    except:
-        print(f"ERROR: Reading {filename}")
-        continue
-
-    pdf = Pdf.open(filename)
-
-    if not EXTRACT_ALL_IMAGES:
-        page_categories = IMAGES_DIRECTORY[year]
+        for image_name, extension, image_bytes in images:
+            with open(f"{temporary_folder}/{image_name}{extension}", 'wb') as file:
+                file.write(image_bytes)
+        if os.path.exists(folder_name):     # only when overwriting
+            shutil.rmtree(folder_name)
+        os.replace(temporary_folder, folder_name)
+    except BaseException:
+        shutil.rmtree(temporary_folder, ignore_errors=True)
+        raise
+
+
+def extract_pdf(filename: str, overwrite: bool = False):
+    """Extracts the charts of a subject report into its own folder"""
+    folder_name = prepare_folder(filename, overwrite)
+    if folder_name is not None:
+        write_images(folder_name, decode_pdf(filename))
+
+
+def extract_pdfs(filenames: list, overwrite: bool = False, workers: int = None, writers: int = 4,
+                 max_pending: int = None) -> dict:
+    """Extracts several subject reports at once. Returns a dict mapping filename to error for those which failed"""
+    errors = {}
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    filenames = iter(filenames)
+    decoding = {}   # dict mapping future to (filename, folder name)
+    writing = {}    # dict mapping future to filename
+
+    with ProcessPoolExecutor(max_workers=workers) as decode_executor, \
+            ThreadPoolExecutor(max_workers=writers) as write_executor:
+        while True:
+            # Only start decoding more reports once there is room for them (backpressure)
+            while len(decoding) + len(writing) < max_pending:
+                filename = next(filenames, None)
+                if filename is None:
+                    break
+                try:
+                    folder_name = prepare_folder(filename, overwrite)
+                except (ValueError, OSError) as error:
+                    errors[filename] = error
+                    continue
+                if folder_name is not None:
+                    decoding[decode_executor.submit(decode_pdf, filename)] = (filename, folder_name)
+
+            if not decoding and not writing:
+                break
+
+            done, _ = wait(list(decoding) + list(writing), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in decoding:
+                    filename, folder_name = decoding.pop(future)
+                    try:
+                        writing[write_executor.submit(write_images, folder_name, future.result())] = filename
+                    except Exception as error:
+                        errors[filename] = error
+                else:
+                    filename = writing.pop(future)
+                    if future.exception() is not None:
+                        errors[filename] = future.exception()
+    return errors
+
+
+def main(filenames: list = None, overwrite: bool = False, workers: int = None):
+    if not os.path.exists(PDFS_FOLDER_NAME):
+        os.mkdir(PDFS_FOLDER_NAME)
+
+    if filenames is None:
+        filenames = glob.glob(f"{PDFS_FOLDER_NAME}/*.pdf")
+
+    if workers == 1:
+        errors = {}
+        for filename in filenames:
+            try:
+                extract_pdf(filename, overwrite)
+            except Exception as error:
+                errors[filename] = error
     else:
-        page_categories = {f"Unknown{page_num}": page_num for page_num in range(1, len(pdf.pages) + 1)}
+        errors = extract_pdfs(filenames, overwrite, workers)
 
-    for graph_type, page_number in page_categories.items():
-        page = pdf.pages[page_number - 1]
+    if errors:
+        print(f"ERROR: {len(errors)} subject report(s) could not be extracted:")
+        for filename, error in sorted(errors.items()):
+            print(f"    {filename}: {error!r}")
+    return not errors
 
-        if len(page.images) < 1:    # if a page has no images, try the previous one instead
-            page = pdf.pages[page_number - 2]
 
-        for image_index, image_data in enumerate(page.images.values()):
-            image = PdfImage(image_data)
-            out = image.extract_to(
-                fileprefix=f"{folder_name}/{graph_type}-page{page_number:02}-img{image_index + 1:02}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extracts the charts from the subject reports.")
+    parser.add_argument("filenames", nargs="*",
+                        help=f"subject reports to extract (defaults to every PDF in {PDFS_FOLDER_NAME})")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="extract the charts again even if the subject's folder already exists")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of subject reports decoded at once (defaults to the number of cores, "
+                             "1 extracts them one at a time without starting any processes)")
+    args = parser.parse_args()
+    if not main(args.filenames or None, args.overwrite, args.workers):
+        sys.exit(1)
@@ -1,234 +1,370 @@
+"""
+NumPy, PIL, pikepdf and multiprocessing are only imported once a chart needs parsing (or a PDF reading),
+so that merging shards and --help start quickly.
+"""
+from __future__ import annotations
 import os
-import csv
+import sys
 import glob
 import json
-import numpy as np
-from PIL import Image
+import argparse
+import itertools
+from typing import TYPE_CHECKING
+from cache import ResultCache
+from shards import get_shard_name, get_shard_filename, select_subjects, get_inputs_hash, is_shard_current, \
+    write_shard, merge_shards
+from pdf_images import DATA_TYPES, get_folder_name, get_subject_folder, get_chart_images, get_image_name, \
+    get_image_page, get_index_settings_hash
 from constants import NUMBER_OF_INTERVALS, MATH_SCIENCE_SUBJECTS, NUMBER_OF_MARKS
-from settings import IMAGES_FOLDER_NAME, OUTPUT_FOLDER_NAME, DEBUG_FOLDER_NAME, JSON_DATA_NAME
-
-
-class ImageParser:
-    def __init__(self, filename: str):
-        """Settings"""
-        self.DEBUG = False
-
-        self.WHITE_PIXEL = (255, 255, 255)  # index of 0
-        self.BLACK_PIXEL = (2, 2, 2)        # index of 1
-        self.BLUE_PIXEL = (165, 199, 233)  # index of 2
-
-        # A rough guide on how thick the x-axis is
-        self.X_AXIS_WIDTH = 4
-        # How rows of consecutive black pixels (with same x position)
-        # need to be counted for it to be considered the y-axis
-        # and vice versa for x-axis
-        self.AXIS_MIN_COUNT = 15
-
-        # Translate the x-axis down this many pixels in case it is not perfectly smooth
-        self.X_AXIS_OFFSET = 1
-
-        """Init"""
-        self.filename = filename
-        self.image_original = Image.open(filename)
-        self.image = self.preprocess_image()
-
-        """Variables"""
-        self.y_axis = 0         # the x-coordinate of the y-axis (from the right-most black pixel)
-        self.x_axis = 0         # the y-coordinate of the x-axis (from the bottom-most black pixel)
-        self.intervals = []     # the x-coordinates of the intervals on the x-axis
-        self.bars_x = []        # the x-coordinates (centre) of the bars in the graph
-        self.bars_height = {}   # dict mapping x-coordinate (centre) of bars to their height
-        self.bars = {}          # dict mapping x-coordinate (centre) of bars to their percentage (actually decimal)
-        self.score_lookup = {}  # dict mapping raw score to percentage
-
-        if self.DEBUG and not os.path.exists(DEBUG_FOLDER_NAME):
-            os.mkdir(DEBUG_FOLDER_NAME)
-
-        """Methods"""
-        self.locate_y_axis()
-        self.locate_x_axis()
-        self.locate_intervals()
-        self.locate_bars()
-        self.get_bar_height()
-        self.calculate_bar_percentages()
-        self.get_score_mapping()
-
-        if self.DEBUG:
-            with open(f"{DEBUG_FOLDER_NAME}/lookup.csv", 'w') as file:
-                writer = csv.writer(file)
-                for percentile in self.score_lookup.values():
-                    writer.writerow([percentile])
-
-    def preprocess_image(self):
-        palette = [
-            # ORDER MATTERS HERE
-            *self.WHITE_PIXEL,  # index of 0
-            *self.BLACK_PIXEL,  # index of 1
-            *self.BLUE_PIXEL,   # index of 2
-        ]
-
-        image_palette = Image.new("P", (3, 1))
-        image_palette.putpalette(palette)
-
-        quantised_image = self.image_original.quantize(colors=3, palette=image_palette, dither=Image.Dither.NONE)
-
-        if self.DEBUG:
-            quantised_image.save(f"{DEBUG_FOLDER_NAME}/quantised.png")
-
-        return quantised_image
-
-    def locate_y_axis(self):
-        """Finds the x-coordinate of the right-most pixel of the y-axis"""
-        # dict with key being x-coord of last black pixel in the first consecutive group of black pixels in each row
-        last_black_pixels = {}
-        for y in range(self.image.height):
-            # find the first black pixel in each row and add it to the dict
-            black_pixels_found = False
-            for x in range(self.image.width):
-                pixel = self.image.getpixel((x, y))
-                if black_pixels_found and pixel != 1:     # the first white pixel after the last black pixel
-                    if x in last_black_pixels:
-                        last_black_pixels[x] += 1
-                    else:
-                        last_black_pixels[x] = 1
-                    break
-                if not black_pixels_found and pixel == 1:  # if pixel is the black pixel to be found
-                    black_pixels_found = True
-
-            # check if there has been many black pixels on the same x-coord (i.e. vertical line = y-axis)
-            if len(last_black_pixels) > 0:
-                for x_coord, frequency in last_black_pixels.items():
-                    if frequency > self.AXIS_MIN_COUNT:
-                        self.y_axis = x_coord
-                        if self.y_axis / self.image.width > 0.2:    # y-axis should be roughly in left-most 20% of image
-                            print(f"WARNING: Possibly invalid y-axis position ({self.y_axis}) in {self.filename}")
-                        return self.y_axis
-
-        print("ERROR: Couldn't locate y-axis")
-
-    def locate_x_axis(self):
-        """Finds the y-coordinate of the bottom of the x-axis"""
-        first_black_pixels = {}  # dict with key being y-coord of first black pixel in each column
-        for x in range(self.y_axis, self.image.width):
-            # find the first black pixel in each column (starting from bottom) and add it to the dict
-            for y in range(self.image.height - 1, 0, -1):
-                pixel = self.image.getpixel((x, y))
-                if pixel == 1:  # if pixel is black
-                    if y in first_black_pixels:
-                        first_black_pixels[y] += 1
-                    else:
-                        first_black_pixels[y] = 1
-                    break
-            # check if there has been many black pixels on the same x-coord (i.e. vertical line = y-axis)
-            if len(first_black_pixels) > 0:
-                for y_coord, frequency in first_black_pixels.items():
-                    if frequency > self.AXIS_MIN_COUNT:
-                        self.x_axis = (y_coord + 1  # +1 because it needs to be the pixel before the first black pixel
-                                       + self.X_AXIS_OFFSET)    # extra offset for safety
-                        if self.x_axis / self.image.height < 0.8:   # x-axis should be in roughly bottom 20% of image
-                            print(f"WARNING: Possibly invalid x-axis position ({self.x_axis}) in {self.filename}")
-                        return self.x_axis
-
-        print("ERROR: Couldn't locate x-axis")
-
-    def locate_intervals(self):
-        """Locates the x-coordinates (left-most pixel) of the axis-ticks of the x-axis"""
-        skip_remaining_black_pixels = False     # ensures that consecutive black pixels are only counted once
-        for x in range(self.y_axis, self.image.width):
-            pixel = self.image.getpixel((x, self.x_axis))
-            if pixel == 1 and not skip_remaining_black_pixels:     # if black pixel
-                self.intervals.append(x)
-                skip_remaining_black_pixels = True
-            elif pixel != 1:
-                skip_remaining_black_pixels = False
-
-        # Checks that the intervals are fairly evenly spaced
-        differences = np.ediff1d(self.intervals)
-        median_diff = np.median(differences)
-        for i in differences:
-            discrepancy = abs(i - median_diff)
-            if discrepancy > 1:
-                print(f"WARNING: Possibly invalid position of interval (discrepancy of {discrepancy}) in {self.filename}")
-
-        # Checks that the number of intervals found is valid
-        if len(self.intervals) not in NUMBER_OF_INTERVALS:
-            print(f"ERROR: Invalid number of intervals ({len(self.intervals)}) in {self.filename}. SKIPPING")
-
-    def locate_bars(self):
-        """Locates the x-coordinates (center) of each bar"""
-        num_bars = NUMBER_OF_INTERVALS[len(self.intervals)]
-        self.bars_x = np.round(np.linspace(self.intervals[0], self.intervals[-1], num_bars)).astype(int)
-
-    def get_bar_height(self):
-        for bar_x in self.bars_x:
-            # Take the median of 3 columns in the bar to prevent outliers
-            heights = []
-            for x in range(bar_x - 1, bar_x + 2):
-                height = 0
-                for y in range(self.x_axis - self.X_AXIS_WIDTH):
-                    pixel = self.image.getpixel((x, y))
-                    if pixel == 2:
-                        height += 1
-                        if self.DEBUG:
-                            self.image.putpixel((x, y), (255, 0, 0))
-                heights.append(height)
-
-            median_height = int(np.median(heights))
-            self.bars_height[bar_x] = median_height
-
-        if self.DEBUG:
-            self.image.save(f"{DEBUG_FOLDER_NAME}/bars.png")
-
-    def calculate_bar_percentages(self):
-        """Convert height of each bar to percentage"""
-        total_height = sum(self.bars_height.values())
-        for bar_x, height in self.bars_height.items():
-            self.bars[bar_x] = height / total_height
-
-    def get_score_mapping(self):
-        """Enumerate the bars to convert them into their corresponding raw score"""
-        for raw_score, percentage in enumerate(self.bars.values()):
-            self.score_lookup[raw_score] = percentage
-
-
-def main():
+from settings import PDFS_FOLDER_NAME, IMAGES_FOLDER_NAME, OUTPUT_FOLDER_NAME, JSON_DATA_NAME, SHARDS_FOLDER_NAME, \
+    VALIDATION_REPORT_NAME
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+def analyse_image(image_filename: str, image: Image.Image = None):
+    """
+    Parses a single chart. Returns its score lookup, the number of intervals found on its x-axis,
+    how unevenly spaced they are (see ImageParser.tick_spacing) and the metrics of the parser.
+    """
+    from image_parser import ImageParser
+    image_parser = ImageParser(image_filename, image)
+    return image_parser.score_lookup, len(image_parser.intervals), image_parser.tick_spacing, \
+        image_parser.get_metrics()
+
+
+def analyse_images(image_filenames: list, workers: int = None):
+    """
+    Parses the charts on a pool of worker processes (defaults to one per core).
+    Yields the result of analyse_image for each chart in the same order as image_filenames,
+    or the exception raised if a chart could not be parsed.
+    """
+    if workers == 1:
+        for image_filename in image_filenames:
+            try:
+                yield analyse_image(image_filename)
+            except Exception as error:
+                yield error
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(analyse_image, image_filename) for image_filename in image_filenames]
+        for future in futures:
+            try:
+                yield future.result()
+            except Exception as error:
+                yield error
+
+
+def check_number_of_bars(subject_folder: str, data_type: str, number_of_intervals: int, image_filename: str):
+    """Raises a ValueError if a chart doesn't have a bar for every possible mark of the subject"""
+    subject_short_name = subject_folder[:-3]
+    is_math_science = (subject_short_name in MATH_SCIENCE_SUBJECTS)
+    if data_type != "Total" \
+            and NUMBER_OF_INTERVALS[number_of_intervals] != NUMBER_OF_MARKS[is_math_science][data_type] + 1:
+        raise ValueError(f"Number of bars ({NUMBER_OF_INTERVALS[number_of_intervals]}) "
+                         f"not what was expected ({NUMBER_OF_MARKS[is_math_science][data_type] + 1}) "
+                         f"in {image_filename}.")
+
+
+def fits_data_type(subject_folder: str, data_type: str, result, image_filename: str) -> bool:
+    """Whether a chart was parsed and has a bar for every possible mark of the data type (see check_number_of_bars)"""
+    if isinstance(result, Exception):
+        return False
+    try:
+        check_number_of_bars(subject_folder, data_type, result[1], image_filename)
+    except ValueError:
+        return False
+    return True
+
+
+def swap_shared_page_charts(charts: list, results: list):
+    """
+    Charts which share a page (e.g. the 2022 Externals and Total) are told apart by the order they are drawn in.
+    If two of them only both have the right number of bars the other way around, they are swapped (in place).
+    Charts with the same number of bars (e.g. math/science subjects) keep the drawing order.
+    """
+    by_page = {}    # dict mapping (subject folder, page number) to the indices of its charts
+    for index, (subject_folder, _, image_filename) in enumerate(charts):
+        page_number = get_image_page(image_filename)
+        if page_number is not None:
+            by_page.setdefault((subject_folder, page_number), []).append(index)
+
+    for indices in by_page.values():
+        for first, second in itertools.combinations(indices, 2):
+            (subject_folder, first_type, first_filename), (_, second_type, second_filename) = charts[first], \
+                charts[second]
+            if fits_data_type(subject_folder, first_type, results[first], first_filename) \
+                    and fits_data_type(subject_folder, second_type, results[second], second_filename):
+                continue
+            if fits_data_type(subject_folder, first_type, results[second], second_filename) \
+                    and fits_data_type(subject_folder, second_type, results[first], first_filename):
+                print(f"WARNING: Using {second_filename} for {first_type} and {first_filename} for {second_type} "
+                      f"of {subject_folder}, since only that way round do both have the right number of bars.")
+                charts[first], charts[second] = (subject_folder, first_type, second_filename), \
+                    (subject_folder, second_type, first_filename)
+                results[first], results[second] = results[second], results[first]
+
+
+def get_subject_folders(from_pdfs: bool = False) -> list:
+    """Gets every subject folder in IMAGES_FOLDER_NAME (or of every subject report in PDFS_FOLDER_NAME), sorted"""
+    if from_pdfs:
+        return sorted(get_subject_folder(pdf_filename) for pdf_filename in glob.glob(f"{PDFS_FOLDER_NAME}/*.pdf"))
+
     if not os.path.exists(IMAGES_FOLDER_NAME):
         raise FileNotFoundError(f"No folder called {IMAGES_FOLDER_NAME} found.")
+    return sorted(subject_folder for subject_folder in os.listdir(IMAGES_FOLDER_NAME)
+                  if not subject_folder.startswith("."))     # Skip hidden folders
 
-    data = {"Internals": {}, "Externals": {}, "Total": {}}
 
-    # Analyze images for percentile data
-    for subject_folder in os.listdir(IMAGES_FOLDER_NAME):
-        # Skip hidden folders
-        if subject_folder.startswith("."):
-            continue
+def get_chart_filenames(subject_folder: str) -> list:
+    """
+    Gets the charts of a subject folder, sorted. Charts are extracted as PNGs or (if stored as such in the report)
+    JPEGs, and a JPEG is only used if fbcnn.py hasn't converted it into a PNG of the same name
+    """
+    png_filenames = glob.glob(f"{IMAGES_FOLDER_NAME}/{subject_folder}/*.png")
+    converted = {os.path.splitext(png_filename)[0] for png_filename in png_filenames}
+    jpeg_filenames = [jpeg_filename for jpeg_filename in glob.glob(f"{IMAGES_FOLDER_NAME}/{subject_folder}/*.jpg")
+                      if os.path.splitext(jpeg_filename)[0] not in converted]
+    return sorted(png_filenames + jpeg_filenames)
+
 
-        subject_short_name = subject_folder[:-3]
-        is_math_science = (subject_short_name in MATH_SCIENCE_SUBJECTS)
-        # year = "20" + subject_folder[-2:]
-        # subject_data = {}
-        for image_filename in glob.glob(f"{IMAGES_FOLDER_NAME}/{subject_folder}/*.png"):
+def analyse_image_folders(workers: int = None, use_cache: bool = True, subject_folders: list = None):
+    """
+    Parses every chart in the subject folders of IMAGES_FOLDER_NAME (or only the given subject folders).
+    Returns the subject folders, a list of (subject folder, data type, image filename) for each chart
+    and a list of the result of analyse_image (or the exception raised) for each chart.
+    """
+    # Find the images to analyse (sorted so that the output is always in the same order)
+    if subject_folders is None:
+        subject_folders = get_subject_folders()
+    charts = []     # list of (subject folder, data type, image filename)
+    for subject_folder in subject_folders:
+        for image_filename in get_chart_filenames(subject_folder):
             # Whether "Internals", "Externals" or "Total"
             data_type = image_filename.split("/")[-1].split("-")[0]
-            if data_type not in data:
-                raise KeyError(f"Data Type {data_type} is not one of 'Internals', 'Externals' or 'Total'")
+            charts.append((subject_folder, data_type, image_filename))
+
+    results = [None] * len(charts)
+    for index, (_, data_type, _) in enumerate(charts):
+        if data_type not in DATA_TYPES:
+            results[index] = KeyError(f"Data Type {data_type} is not one of 'Internals', 'Externals' or 'Total'")
+
+    # Reuse the results of any images which have already been analysed
+    if use_cache:
+        from image_parser import ImageParser
+        cache = ResultCache(ImageParser.get_settings_hash())
+        content_hashes = [ResultCache.hash_file(image_filename) for _, _, image_filename in charts]
+        for index, content_hash in enumerate(content_hashes):
+            if results[index] is None:
+                cached = cache.get(content_hash)
+                if cached is not None:
+                    results[index] = (*cached, None)    # there are no metrics since it wasn't parsed
 
-            image_parser = ImageParser(image_filename)
+    # Analyze images for percentile data
+    uncached = [index for index, result in enumerate(results) if result is None]
+    for index, result in zip(uncached, analyse_images([charts[index][2] for index in uncached], workers)):
+        results[index] = result
+        if use_cache and not isinstance(result, Exception):
+            cache.put(content_hashes[index], *result[:3])
+
+    if use_cache:
+        cache.save()
+        print(f"Cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+
+    return subject_folders, charts, results
+
+
+def analyse_pdfs(pdf_filenames: list, save_images: bool = False, workers: int = None, use_cache: bool = True):
+    """
+    Parses the charts straight out of each subject report, without writing them to disk first.
+    Yields (subject folder, list of (data type, image name, result)) for each report, where the result is
+    that of analyse_image for each chart found by the index of the report (or the exception raised).
+    The reports are read in this process while their charts are parsed on a pool of worker processes
+    (like analyse_images, 1 parses them in this process too). Only a few reports are waiting at once,
+    which caps the memory used by decoded charts.
+    Charts in the result cache (keyed by the hash of their raw stream in the report) aren't decoded at all.
+    If save_images is True, the charts are also extracted to the folder used by 1_extract_images.py for debugging.
+    """
+    import contextlib
+    from collections import deque
+    from pikepdf import Pdf
+    from concurrent.futures import Future
+
+    if use_cache:
+        from image_parser import ImageParser
+        cache = ResultCache(ImageParser.get_settings_hash())
+
+    def get_results(subject_results: list) -> list:
+        results = []
+        for data_type, image_name, result, content_hash in subject_results:
+            if isinstance(result, Future):
+                try:
+                    result = result.result()
+                except Exception as error:
+                    result = error
+            if use_cache and content_hash is not None and not isinstance(result, Exception) \
+                    and result[3] is not None:   # i.e. it was parsed rather than taken from the cache
+                cache.put(content_hash, *result[:3])
+            results.append((data_type, image_name, result))
+        return results
+
+    if workers == 1:
+        pool = contextlib.nullcontext()
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=workers)
+    max_pending = 2 * (workers or os.cpu_count() or 1)
+
+    with pool as executor:
+        pending = deque()   # (subject folder, list of (data type, image name, result or future, content hash))
+        for pdf_filename in pdf_filenames:
+            subject_folder = get_subject_folder(pdf_filename)
+            try:
+                pdf = Pdf.open(pdf_filename)
+            except Exception as error:
+                pending.append((subject_folder, [(None, pdf_filename, error, None)]))
+                continue
+
+            folder_name = get_folder_name(pdf_filename)
+            if save_images:
+                os.makedirs(folder_name, exist_ok=True)
+
+            subject_results = []
+            with pdf:
+                for data_type, page_number, image_index, image in get_chart_images(pdf_filename, pdf):
+                    image_name = get_image_name(data_type, page_number, image_index)
+                    if save_images:
+                        image.extract_to(fileprefix=f"{folder_name}/{image_name}")
+
+                    content_hash = None
+                    try:
+                        # Reuse the result of any chart which has already been analysed
+                        cached = None
+                        if use_cache:
+                            content_hash = ResultCache.hash_bytes(image.obj.read_raw_bytes())
+                            cached = cache.get(content_hash)
+
+                        if cached is not None:
+                            result = (*cached, None)    # there are no metrics since it wasn't parsed
+                        elif executor is None:
+                            result = analyse_image(f"{pdf_filename}:{image_name}", image.as_pil_image())
+                        else:
+                            result = executor.submit(analyse_image, f"{pdf_filename}:{image_name}",
+                                                     image.as_pil_image())
+                    except Exception as error:
+                        result = error
+                    subject_results.append((data_type, image_name, result, content_hash))
+            pending.append((subject_folder, subject_results))
+
+            # Wait for the oldest report before decoding any more (backpressure)
+            while len(pending) > max_pending:
+                subject_folder, subject_results = pending.popleft()
+                yield subject_folder, get_results(subject_results)
+
+        while pending:
+            subject_folder, subject_results = pending.popleft()
+            yield subject_folder, get_results(subject_results)
+
+    if use_cache:
+        cache.save()
+        print(f"Cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+
+
+def write_profile(filename: str, all_metrics: list, number_shown: int = 10):
+    """Writes the metrics of each parsed image as JSON lines and prints the slowest images and stages"""
+    with open(filename, 'w') as file:
+        for metrics in all_metrics:
+            file.write(json.dumps(metrics) + "\n")
+
+    print(f"Slowest {min(number_shown, len(all_metrics))} of {len(all_metrics)} parsed images:")
+    for metrics in sorted(all_metrics, key=lambda metrics: metrics["total_time"], reverse=True)[:number_shown]:
+        slowest_stage = max(metrics["stage_times"], key=metrics["stage_times"].get, default=None)
+        print(f"    {metrics['total_time'] * 1000:8.1f}ms  {metrics['filename']} "
+              f"(slowest stage {slowest_stage}, {len(metrics['warnings'])} warning(s))")
+
+    stage_times = {}
+    for metrics in all_metrics:
+        for stage, stage_time in metrics["stage_times"].items():
+            stage_times.setdefault(stage, []).append(stage_time)
+    print("Time spent in each stage:")
+    for stage, times in sorted(stage_times.items(), key=lambda item: sum(item[1]), reverse=True):
+        print(f"    {sum(times):8.2f}s total  {sum(times) / len(times) * 1000:8.2f}ms mean  "
+              f"{max(times) * 1000:8.2f}ms max  {stage}")
+    print(f"Wrote the metrics of each image to {filename}")
+
+
+def analyse(subject_folders: list, workers: int = None, use_cache: bool = True, from_pdfs: bool = False,
+            save_images: bool = False):
+    """
+    Parses the charts of the subject folders into their data (data type -> subject folder -> score lookup).
+    Returns the data, the checks of each chart used by validation.py (in the same structure as the data),
+    a list of (image filename, exception) for every image which couldn't be analysed
+    and the metrics of every image which was parsed (rather than taken from the cache).
+    """
+    data = {data_type: {} for data_type in DATA_TYPES}
+    checks = {data_type: {} for data_type in DATA_TYPES}
+    errors = []
+
+    if from_pdfs:
+        charts, results = [], []
+        selected = set(subject_folders)
+        pdf_filenames = [pdf_filename for pdf_filename in sorted(glob.glob(f"{PDFS_FOLDER_NAME}/*.pdf"))
+                         if get_subject_folder(pdf_filename) in selected]
+        for subject_folder, subject_results in analyse_pdfs(pdf_filenames, save_images, workers, use_cache):
+            for data_type, image_name, result in subject_results:
+                charts.append((subject_folder, data_type, image_name))
+                results.append(result)
+    else:
+        _, charts, results = analyse_image_folders(workers, use_cache, subject_folders)
+    swap_shared_page_charts(charts, results)
+    # Charts parsed in this process (e.g. with --workers 1) may still have debug output waiting to be written
+    from debug_output import flush
+    flush()
+
+    all_metrics = []
+    for (subject_folder, data_type, image_filename), result in zip(charts, results):
+        if isinstance(result, Exception):
+            errors.append((image_filename, result))
+            if hasattr(result, "metrics"):
+                all_metrics.append({**result.metrics, "error": f"{type(result).__name__}: {result}"})
+            continue
+        score_lookup, number_of_intervals, tick_spacing, metrics = result
+        if metrics is not None:
+            all_metrics.append(metrics)
+
+        try:
+            check_number_of_bars(subject_folder, data_type, number_of_intervals, image_filename)
+        except ValueError as error:
+            errors.append((image_filename, error))
+            continue
+
+        data[data_type][subject_folder] = score_lookup
+        checks[data_type][subject_folder] = {"tick_spacing": tick_spacing}
 
-            if data_type != "Total" \
-                    and NUMBER_OF_INTERVALS[len(image_parser.intervals)] \
-                    != NUMBER_OF_MARKS[is_math_science][data_type] + 1:
-                raise ValueError(f"Number of bars ({NUMBER_OF_INTERVALS[len(image_parser.intervals)]}) "
-                                 f"not what was expected ({NUMBER_OF_MARKS[is_math_science][data_type] + 1}) "
-                                 f"in {image_filename}.")
+    return data, checks, errors, all_metrics
 
-            data[data_type][subject_folder] = image_parser.score_lookup
 
-        # Checks that each subject appears in Internals, Externals and Total
+def check_data_types(subject_folders: list, data: dict):
+    """Checks that each subject appears in Internals, Externals and Total"""
+    for subject_folder in subject_folders:
         for data_type in data:
             if subject_folder not in data[data_type]:
                 print(f"WARNING: Subject {subject_folder} not in data for type {data_type}.")
 
+
+def report_errors(errors: list):
+    """Reports every image which failed together, rather than stopping at the first one"""
+    if errors:
+        print(f"ERROR: {len(errors)} image(s) could not be analysed:")
+        for image_filename, error in errors:
+            message = f"{type(error).__name__}: {error}" if isinstance(error, Exception) else error
+            print(f"    {image_filename}: {message}")
+
+
+def write_data(data: dict, checks: dict):
     if not os.path.exists(OUTPUT_FOLDER_NAME):
         os.mkdir(OUTPUT_FOLDER_NAME)
 
@@ -248,6 +384,131 @@ def main():
     with open(f"{OUTPUT_FOLDER_NAME}/{JSON_DATA_NAME}.json", 'w') as file:
         json.dump(data, file, indent=4)
 
+    # Rank every chart by how likely it is to have been parsed wrongly
+    from validation import score_charts, write_report
+    write_report(f"{OUTPUT_FOLDER_NAME}/{VALIDATION_REPORT_NAME}.json", score_charts(data, checks))
+
+
+def merge(shard_filenames: list, from_pdfs: bool = False) -> bool:
+    """Merges shard files into the data file. Returns False (without writing it) if the shards don't fit together"""
+    subject_folders = get_subject_folders(from_pdfs)
+    data, checks, errors, problems = merge_shards(shard_filenames, subject_folders, DATA_TYPES)
+    print(f"Merging {len(shard_filenames)} shard(s)")
+
+    if problems:
+        print(f"ERROR: {len(problems)} problem(s) with the shards in {SHARDS_FOLDER_NAME}:")
+        for problem in problems:
+            print(f"    {problem}")
+        return False
+
+    check_data_types(subject_folders, data)
+    report_errors(errors)
+    write_data(data, checks)
+    return True
+
+
+def get_shard_inputs_hash(subject_folders: list, from_pdfs: bool = False) -> str:
+    """Hashes the charts (or subject reports) of the subjects in a shard and the settings used to parse them"""
+    from image_parser import ImageParser
+    settings = [ImageParser.get_settings_hash(), from_pdfs]
+    if from_pdfs:
+        selected = set(subject_folders)
+        filenames = [pdf_filename for pdf_filename in glob.glob(f"{PDFS_FOLDER_NAME}/*.pdf")
+                     if get_subject_folder(pdf_filename) in selected]
+        settings.append(get_index_settings_hash())
+    else:
+        filenames = [image_filename for subject_folder in subject_folders
+                     for image_filename in get_chart_filenames(subject_folder)]
+    return get_inputs_hash(filenames, settings)
+
+
+def main(workers: int = None, use_cache: bool = True, from_pdfs: bool = False, save_images: bool = False,
+         profile_filename: str = None, shard: int = None, number_of_shards: int = None, subjects: list = None,
+         merge_only: bool = False) -> bool:
+    """
+    Analyses every subject into the data file, or only one shard of the subjects into its own shard file
+    (chosen by shard and number_of_shards, or by an explicit list of subjects).
+    If number_of_shards is given without a shard, every shard without a shard file is analysed, then all are merged.
+    """
+    if merge_only:
+        return merge(glob.glob(f"{SHARDS_FOLDER_NAME}/*.json"), from_pdfs)
+
+    subject_folders = get_subject_folders(from_pdfs)
+
+    if number_of_shards is not None and shard is None and subjects is None:
+        shard_filenames = []
+        all_metrics = []    # of the shards analysed now (those which already finished weren't parsed again)
+        for shard in range(number_of_shards):
+            shard_name = get_shard_name(shard, number_of_shards)
+            shard_filenames.append(get_shard_filename(shard_name))
+            shard_subject_folders = select_subjects(subject_folders, shard, number_of_shards)
+            inputs_hash = get_shard_inputs_hash(shard_subject_folders, from_pdfs)
+            # Shards which already finished (e.g. before a crash) aren't analysed again, unless their subjects
+            # or charts have changed since
+            if is_shard_current(shard_name, shard_subject_folders, inputs_hash):
+                print(f"Skipping {shard_name} since it has already been analysed.")
+                continue
+            print(f"Analysing {shard_name}")
+            data, checks, errors, metrics = analyse(shard_subject_folders, workers, use_cache, from_pdfs, save_images)
+            all_metrics.extend(metrics)
+            write_shard(shard_name, shard_subject_folders, data, checks, errors, inputs_hash)
+        if profile_filename is not None:
+            write_profile(profile_filename, all_metrics)
+        return merge(shard_filenames, from_pdfs)
+
+    is_shard = shard is not None or subjects is not None
+    if is_shard:
+        subject_folders = select_subjects(subject_folders, shard, number_of_shards, subjects)
+
+    data, checks, errors, all_metrics = analyse(subject_folders, workers, use_cache, from_pdfs, save_images)
+
+    if not is_shard:
+        check_data_types(subject_folders, data)
+
+    if profile_filename is not None:
+        write_profile(profile_filename, all_metrics)
+
+    report_errors(errors)
+
+    if is_shard:
+        # The data types of each subject are checked once all of the shards are merged
+        shard_name = get_shard_name(shard, number_of_shards, subjects)
+        write_shard(shard_name, subject_folders, data, checks, errors,
+                    get_shard_inputs_hash(subject_folders, from_pdfs))
+        print(f"Wrote {len(subject_folders)} subject(s) to {get_shard_filename(shard_name)}")
+    else:
+        write_data(data, checks)
+    return True
+
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Analyses the extracted charts into percentage data.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes used to parse the charts (defaults to the number of cores)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="re-analyse every chart instead of reusing cached results")
+    parser.add_argument("--from-pdfs", action="store_true",
+                        help=f"parse the charts straight from the subject reports in {PDFS_FOLDER_NAME} "
+                             f"instead of the extracted images in {IMAGES_FOLDER_NAME}")
+    parser.add_argument("--save-images", action="store_true",
+                        help="with --from-pdfs, also extract the charts to disk for debugging")
+    parser.add_argument("--profile", metavar="FILENAME", default=None,
+                        help="write the timings and warnings of each parsed image to this file as JSON lines "
+                             "and print the slowest images and stages")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="split the subjects into this many shards by hash. Without --shard, every shard "
+                             f"which hasn't finished yet (see {SHARDS_FOLDER_NAME}) is analysed, then all are merged")
+    parser.add_argument("--shard", type=int, default=None,
+                        help="with --shards, only analyse this shard (from 0) and write it to its own shard file")
+    parser.add_argument("--subjects", nargs="+", default=None,
+                        help="only analyse these subject folders (e.g. accounting_22) and write them to a shard file")
+    parser.add_argument("--merge", action="store_true",
+                        help=f"merge every shard file in {SHARDS_FOLDER_NAME} into {JSON_DATA_NAME}.json, "
+                             "checking for subjects which are missing or in more than one shard")
+    args = parser.parse_args()
+    if args.shard is not None and (args.shards is None or not 0 <= args.shard < args.shards):
+        parser.error("--shard needs --shards and must be between 0 and the number of shards - 1")
+    if not main(workers=args.workers, use_cache=not args.no_cache, from_pdfs=args.from_pdfs,
+                save_images=args.save_images, profile_filename=args.profile, shard=args.shard,
+                number_of_shards=args.shards, subjects=args.subjects, merge_only=args.merge):
+        sys.exit(1)
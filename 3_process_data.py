@@ -1,5 +1,7 @@
 import json
-from settings import OUTPUT_FOLDER_NAME, JSON_DATA_NAME
+from distributions import Distributions
+from distribution_store import write_store
+from settings import OUTPUT_FOLDER_NAME, JSON_DATA_NAME, DISTRIBUTION_STORE_NAME
 
 """
 Organises the subjects into years.
@@ -14,38 +16,25 @@ with open(f"{OUTPUT_FOLDER_NAME}/{JSON_DATA_NAME}.json") as file:
     data = json.load(file)
 
 
-data_internals = {}
-data_externals = {}
+# Every subject of every data type is made cumulative at once (see distributions.py)
+distributions = Distributions.from_data(data, SUBJECT_CODES)
 
-for data_type, subjects in data.items():
-    for subject, subject_data in subjects.items():
-        subject_name = subject[:-3]
-        subject_code = SUBJECT_CODES[subject_name]
-        year = "20" + subject[-2:]
-
-        subject_processed_data = {}
-
-        cumulative_percentage = 0
-        for raw_score, percentage in subject_data.items():
-            cumulative_percentage += percentage
-            subject_processed_data[raw_score] = cumulative_percentage
-
-        # Create a pointer to the appropriate dict
-        if data_type == "Internals":
-            data_destination = data_internals
-        elif data_type == "Externals":
-            data_destination = data_externals
-        else:
-            # CURRENTLY SKIPS TOTAL
-            break
-
-        if year in data_destination:
-            data_destination[year][subject_code] = subject_processed_data
-        else:
-            data_destination[year] = {subject_code: subject_processed_data}
+data_internals = distributions.to_dict("Internals")
+data_externals = distributions.to_dict("Externals")
+data_totals = distributions.to_dict("Total")
 
 with open(f"{OUTPUT_FOLDER_NAME}/internals.json", 'w') as file:
     json.dump(data_internals, file)
 
 with open(f"{OUTPUT_FOLDER_NAME}/externals.json", 'w') as file:
     json.dump(data_externals, file)
+
+with open(f"{OUTPUT_FOLDER_NAME}/totals.json", 'w') as file:
+    json.dump(data_totals, file)
+
+# Same data in a binary format which can be memory-mapped (see distribution_store.py)
+write_store(f"{OUTPUT_FOLDER_NAME}/{DISTRIBUTION_STORE_NAME}.bin", {
+    "Internals": data_internals,
+    "Externals": data_externals,
+    "Total": data_totals
+})
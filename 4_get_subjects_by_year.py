@@ -1,13 +1,8 @@
-import csv
 import json
+from subjects import get_subject_names, get_math_science_subjects
 from settings import OUTPUT_FOLDER_NAME
 
-all_subjects = {}
-
-with open("subjects.csv") as file:
-    reader = csv.reader(file)
-    for row in reader:
-        all_subjects[row[0]] = row[2]
+all_subjects = get_subject_names()
 
 subjects_by_year = {}
 
@@ -43,7 +38,6 @@ with open(f"{OUTPUT_FOLDER_NAME}/all_subjects.json", 'w') as file:
     json.dump(all_subjects, file)
 
 
-math_science_subjects = {subject_code: subject_name for subject_code, subject_name in all_subjects.items()
-                         if subject_code in ['3', '6', '8', '15', '25', '37', '38', '47', '49', '53']}
+math_science_subjects = get_math_science_subjects()
 with open(f"{OUTPUT_FOLDER_NAME}/math_science_subjects.json", 'w') as file:
     json.dump(math_science_subjects, file)
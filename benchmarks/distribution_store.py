@@ -0,0 +1,89 @@
+"""
+Compares loading the distributions from JSON (json.load) against the memory-mapped distribution store,
+for a single point lookup, and checks that both hold exactly the same values.
+Run from the root folder with: python -m benchmarks.distribution_store
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from distribution_store import DistributionStore, write_store
+
+DATA_TYPES = ["Internals", "Externals"]
+
+
+def make_distributions(years: int, subjects: int, random) -> dict:
+    """Makes random cumulative distributions in the same structure as internals.json/externals.json"""
+    distributions = {}
+    for data_type in DATA_TYPES:
+        distributions[data_type] = {}
+        for year in range(2020, 2020 + years):
+            distributions[data_type][str(year)] = {}
+            for subject_code in range(1, subjects + 1):
+                number_of_scores = random.choice([26, 51, 76])
+                percentages = random.random(number_of_scores)
+                cumulative = np.cumsum(percentages / percentages.sum()).tolist()
+                distributions[data_type][str(year)][str(subject_code)] = \
+                    {str(raw_score): percentage for raw_score, percentage in enumerate(cumulative)}
+    return distributions
+
+
+def measure(function) -> tuple:
+    """Returns the time (in seconds) and peak traced memory (in bytes) of a function"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    total = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return total, peak_memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the distribution store against JSON.")
+    parser.add_argument("--years", type=int, nargs="+", default=[3, 30, 300],
+                        help="numbers of years of data to benchmark with")
+    parser.add_argument("--subjects", type=int, default=45, help="number of subjects in each year")
+    args = parser.parse_args()
+
+    random = np.random.default_rng(0)
+    print(f"{'years':>6} {'JSON MB':>8} {'store MB':>9} {'json.load ms':>13} {'store ms':>9} "
+          f"{'json.load peak MB':>18} {'store peak MB':>14}  identical")
+    for years in args.years:
+        distributions = make_distributions(years, args.subjects, random)
+        with tempfile.TemporaryDirectory() as folder:
+            json_filenames = {}
+            for data_type in DATA_TYPES:
+                json_filenames[data_type] = f"{folder}/{data_type.lower()}.json"
+                with open(json_filenames[data_type], 'w') as file:
+                    json.dump(distributions[data_type], file)
+            store_filename = f"{folder}/distributions.bin"
+            write_store(store_filename, distributions)
+
+            # A single lookup, as a consumer answering one query would do
+            def lookup_json():
+                with open(json_filenames["Externals"]) as file:
+                    return json.load(file)["2020"]["1"]["10"]
+
+            def lookup_store():
+                return DistributionStore(store_filename).lookup("Externals", "2020", "1", 10)
+
+            json_time, json_memory = measure(lookup_json)
+            store_time, store_memory = measure(lookup_store)
+
+            store = DistributionStore(store_filename)
+            identical = all(store.to_dict(data_type) == distributions[data_type] for data_type in DATA_TYPES)
+
+            json_size = sum(os.path.getsize(filename) for filename in json_filenames.values())
+            store_size = os.path.getsize(store_filename)
+            del store
+
+        print(f"{years:>6} {json_size / 1e6:>8.2f} {store_size / 1e6:>9.2f} {json_time * 1000:>13.2f} "
+              f"{store_time * 1000:>9.2f} {json_memory / 1e6:>18.2f} {store_memory / 1e6:>14.2f}  {identical}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Checks that the memory used while parsing stays flat over thousands of charts,
+for charts saved as RGB and as palette PNGs (as extracted from Indexed PDF images).
+Each run is in a fresh process so that its peak RSS isn't affected by the others.
+Run from the root folder with: python -m benchmarks.memory
+"""
+import io
+import glob
+import argparse
+import contextlib
+import tempfile
+import multiprocessing
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from benchmarks.parser import peak_rss_mb
+from benchmarks.synthetic import write_charts
+
+CHECKPOINTS = [0.1, 0.25, 0.5, 1.0]    # fractions of the charts after which the memory is recorded
+
+
+def parse_charts(image_filenames: list) -> list:
+    """Parses every chart one at a time. Returns (charts parsed, peak RSS MB, traced MB) at each checkpoint"""
+    # Imported here so that the import is counted by the process which does the parsing
+    from image_parser import ImageParser
+
+    checkpoints = {max(round(len(image_filenames) * fraction), 1) for fraction in CHECKPOINTS}
+    results = []
+    tracemalloc.start()
+    for number_parsed, image_filename in enumerate(image_filenames, start=1):
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):     # hide the parser's warnings
+                ImageParser(image_filename)
+        except Exception:
+            pass
+        if number_parsed in checkpoints:
+            current_memory, _ = tracemalloc.get_traced_memory()
+            results.append((number_parsed, peak_rss_mb(), current_memory / (1024 * 1024)))
+    tracemalloc.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the memory used while parsing many charts.")
+    parser.add_argument("--charts", type=int, default=2000, help="number of charts to parse")
+    parser.add_argument("--width", type=int, default=1600, help="width of each chart")
+    parser.add_argument("--height", type=int, default=900, help="height of each chart")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"Writing {args.charts} charts...")
+        write_charts(f"{folder}/images", args.charts, args.width, args.height)
+        rgb_filenames = sorted(glob.glob(f"{folder}/images/*/*.png"))
+
+        # The same charts saved with a palette (only 3 colours so no information is lost)
+        palette_filenames = []
+        for image_filename in rgb_filenames:
+            palette_filename = image_filename.replace(".png", "-palette.png")
+            Image.open(image_filename).convert("P", palette=Image.Palette.ADAPTIVE, colors=8).save(palette_filename)
+            palette_filenames.append(palette_filename)
+
+        print(f"{'format':>8} {'charts':>7} {'peak RSS MB':>12} {'traced MB':>10}")
+        for image_format, image_filenames in [("RGB", rgb_filenames), ("palette", palette_filenames)]:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results = executor.submit(parse_charts, image_filenames).result()
+            for number_parsed, rss_mb, traced_mb in results:
+                print(f"{image_format:>8} {number_parsed:>7} {rss_mb:>12.1f} {traced_mb:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Benchmarks each stage of ImageParser and the whole of 2_analyse_images.main() on synthetic charts.
+Run from the root folder with: python -m benchmarks.parser
+Results are printed and saved as JSON so that runs can be compared.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import platform
+import argparse
+import tempfile
+import importlib
+import tracemalloc
+import numpy as np
+from PIL import Image
+from image_parser import ImageParser
+from benchmarks.synthetic import draw_chart, write_charts
+
+STAGES = [
+    "preprocess_image",
+    "locate_y_axis",
+    "locate_x_axis",
+    "locate_plot_area",
+    "locate_intervals",
+    "locate_bars",
+    "get_bar_height",
+    "calculate_bar_percentages",
+    "get_score_mapping",
+]
+
+CHART_SIZES = [(400, 250), (800, 450), (1600, 900)]
+BARS = [26, 51, 76]
+NOISE = [0.0, 8.0]
+
+
+def summarise(times: list) -> dict:
+    """Summarises a list of times (in seconds) in milliseconds"""
+    times_ms = np.array(times) * 1000
+    return {
+        "count": len(times),
+        "mean_ms": float(times_ms.mean()),
+        "median_ms": float(np.median(times_ms)),
+        "p95_ms": float(np.percentile(times_ms, 95)),
+        "max_ms": float(times_ms.max()),
+    }
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Peak resident memory in MB (ru_maxrss is in KB on Linux but bytes on macOS)"""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def benchmark_stages(repeats: int) -> list:
+    """Times each stage of the parser on charts of every size, number of bars and amount of noise"""
+    results = []
+    for width, height in CHART_SIZES:
+        for number_of_bars in BARS:
+            for noise in NOISE:
+                image, _ = draw_chart(number_of_bars, width, height, noise)
+                stage_times = {stage: [] for stage in STAGES}
+
+                tracemalloc.start()
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    image_parser = ImageParser("synthetic", image.copy())
+                    for stage, stage_time in image_parser.stage_times.items():
+                        stage_times[stage].append(stage_time)
+                total = time.perf_counter() - start
+                _, peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                results.append({
+                    "width": width,
+                    "height": height,
+                    "bars": number_of_bars,
+                    "noise": noise,
+                    "charts_per_second": repeats / total,
+                    "peak_memory_mb": peak_memory / (1024 * 1024),
+                    "stages": {stage: summarise(times) for stage, times in stage_times.items()},
+                })
+    return results
+
+
+def benchmark_main(counts: list, workers: int) -> list:
+    """Times 2_analyse_images.main() (without the result cache) on folders of synthetic charts"""
+    analyse_images = importlib.import_module("2_analyse_images")
+    root_folder = os.getcwd()
+    results = []
+    for count in counts:
+        with tempfile.TemporaryDirectory() as folder:
+            write_charts(f"{folder}/images", count)
+            os.chdir(folder)
+            try:
+                start = time.perf_counter()
+                analyse_images.main(workers=workers, use_cache=False)
+                total = time.perf_counter() - start
+            finally:
+                os.chdir(root_folder)
+
+        results.append({
+            "charts": count,
+            "workers": workers,
+            "seconds": total,
+            "charts_per_second": count / total,
+            "peak_rss_mb": peak_rss_mb(),
+            "peak_rss_workers_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the chart parser on synthetic charts.")
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 1000],
+                        help="numbers of charts to run 2_analyse_images.main() on")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes used by 2_analyse_images.main() (defaults to the number of cores)")
+    parser.add_argument("--repeats", type=int, default=5, help="number of times each chart is parsed")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to save the results to")
+    parser.add_argument("--subpixel", action="store_true", help="measure the bars with ImageParser.SUBPIXEL_HEIGHTS")
+    args = parser.parse_args()
+    ImageParser.SUBPIXEL_HEIGHTS = args.subpixel
+
+    results = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pillow": Image.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "settings_hash": ImageParser.get_settings_hash(),
+        "stages": benchmark_stages(args.repeats),
+    }
+
+    print(f"{'chart':>16} {'charts/s':>9} {'peak MB':>8}  " + " ".join(f"{stage[:12]:>12}" for stage in STAGES))
+    for result in results["stages"]:
+        chart = f"{result['width']}x{result['height']}/{result['bars']}/{result['noise']:g}"
+        print(f"{chart:>16} {result['charts_per_second']:>9.1f} {result['peak_memory_mb']:>8.1f}  "
+              + " ".join(f"{result['stages'][stage]['median_ms']:>10.2f}ms" for stage in STAGES))
+
+    # Run after the stage benchmarks so that the charts drawn above don't count towards the peak memory
+    results["main"] = benchmark_main(args.counts, args.workers)
+    print(f"\n{'charts':>7} {'workers':>8} {'seconds':>8} {'charts/s':>9} {'peak RSS MB':>12} {'workers MB':>11}")
+    for result in results["main"]:
+        print(f"{result['charts']:>7} {str(result['workers']):>8} {result['seconds']:>8.2f} "
+              f"{result['charts_per_second']:>9.1f} {result['peak_rss_mb']:>12.1f} {result['peak_rss_workers_mb']:>11.1f}")
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=4)
+    print(f"\nSaved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Measures how many rows per second the predictor handles, both from arrays and streaming through a CSV,
+and checks the vectorised predictions against predicting one student at a time.
+Run from the root folder with: python -m benchmarks.predictor
+"""
+import csv
+import time
+import argparse
+import tempfile
+import numpy as np
+from predictor import Predictor, INPUT_COLUMNS
+from distributions import Distributions
+from benchmarks.distribution_store import make_distributions
+
+
+def predict_one(distributions: Distributions, year: str, subject_code: str, internal_score: int) -> int:
+    """Predicts a single student without the lookup tables, to check the vectorised predictions against"""
+    percentile = distributions.percentile_for_score("Internals", year, subject_code, internal_score)
+    return int(distributions.score_for_percentile("Externals", year, subject_code, percentile))
+
+
+def make_students(distributions: Distributions, number_of_rows: int, random) -> tuple:
+    """Picks a random subject and internal raw score for each student"""
+    internal_rows = [row for (data_type, _, _), row in distributions.rows.items() if data_type == "Internals"]
+    rows = random.choice(internal_rows, number_of_rows)
+    years = np.array([year for _, year, _ in distributions.keys])[rows]
+    subject_codes = np.array([subject_code for _, _, subject_code in distributions.keys])[rows]
+    internal_scores = (random.random(number_of_rows) * distributions.lengths[rows]).astype(np.intp)
+    return years, subject_codes, internal_scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the score predictor.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000, 500000],
+                        help="numbers of students to predict")
+    parser.add_argument("--years", type=int, default=3, help="number of years of data")
+    parser.add_argument("--subjects", type=int, default=45, help="number of subjects in each year")
+    parser.add_argument("--checked", type=int, default=1000, help="number of predictions checked one at a time")
+    args = parser.parse_args()
+
+    random = np.random.default_rng(0)
+    start = time.perf_counter()
+    predictor = Predictor(Distributions.from_cumulative(make_distributions(args.years, args.subjects, random)))
+    print(f"Built lookup tables in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    print(f"{'rows':>8} {'arrays rows/s':>14} {'CSV rows/s':>11}  identical")
+    for number_of_rows in args.rows:
+        years, subject_codes, internal_scores = make_students(predictor.distributions, number_of_rows, random)
+
+        start = time.perf_counter()
+        predictions = predictor.predict(years, subject_codes, internal_scores)
+        array_time = time.perf_counter() - start
+
+        with tempfile.TemporaryDirectory() as folder:
+            with open(f"{folder}/input.csv", 'w', newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(INPUT_COLUMNS)
+                writer.writerows(zip(years.tolist(), subject_codes.tolist(), internal_scores.tolist()))
+
+            start = time.perf_counter()
+            predictor.predict_csv(f"{folder}/input.csv", f"{folder}/output.csv")
+            csv_time = time.perf_counter() - start
+
+            with open(f"{folder}/output.csv", newline="") as file:
+                csv_predictions = [int(row[-1]) for row in list(csv.reader(file))[1:]]
+
+        checked = range(min(args.checked, number_of_rows))
+        identical = csv_predictions == predictions.tolist() and all(
+            predictions[i] == predict_one(predictor.distributions, years[i], subject_codes[i], internal_scores[i])
+            for i in checked)
+        print(f"{number_of_rows:>8} {number_of_rows / array_time:>14.0f} {number_of_rows / csv_time:>11.0f}  {identical}")
+
+
+if __name__ == "__main__":
+    main()
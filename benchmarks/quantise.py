@@ -0,0 +1,46 @@
+"""
+Compares quantising with PIL's quantize against the lookup table in classify_pixels on images of several sizes.
+Run from the root folder with: python -m benchmarks.quantise
+"""
+import time
+import numpy as np
+from PIL import Image
+from image_parser import ImageParser, classify_pixels
+
+SIZES = [(500, 300), (1000, 600), (2000, 1200), (4000, 2400)]
+REPEATS = 5
+
+
+def quantise_with_pil(image: Image.Image, palette: tuple) -> np.ndarray:
+    image_palette = Image.new("P", (3, 1))
+    image_palette.putpalette(palette)
+    return np.asarray(image.quantize(colors=3, palette=image_palette, dither=Image.Dither.NONE))
+
+
+def time_function(function, *args) -> float:
+    """Returns the fastest of several runs in seconds"""
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    palette = (*ImageParser.WHITE_PIXEL, *ImageParser.BLACK_PIXEL, *ImageParser.BLUE_PIXEL)
+    classify_pixels(Image.new("RGB", (1, 1)), palette)  # build the lookup table before timing
+
+    random = np.random.default_rng(0)
+    print(f"{'size':>10} {'PIL (ms)':>9} {'lookup (ms)':>12} {'lookup/PIL':>11}  identical")
+    for width, height in SIZES:
+        image = Image.fromarray(random.integers(0, 256, (height, width, 3), dtype=np.uint8))
+        identical = np.array_equal(quantise_with_pil(image, palette), classify_pixels(image, palette))
+        pil_time = time_function(quantise_with_pil, image, palette)
+        lookup_time = time_function(classify_pixels, image, palette)
+        print(f"{f'{width}x{height}':>10} {pil_time * 1000:>9.2f} {lookup_time * 1000:>12.2f} "
+              f"{lookup_time / pil_time:>10.2f}x  {identical}")
+
+
+if __name__ == "__main__":
+    main()
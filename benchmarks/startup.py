@@ -0,0 +1,68 @@
+"""
+Measures the start-up cost of each subcommand of cli.py: the time a fresh interpreter takes to import everything
+the subcommand's script imports at the top level (without running it), on top of starting Python itself.
+Also compares loading the compiled subject registry against parsing subjects.csv.
+Run from the root folder with: python -m benchmarks.startup
+"""
+import ast
+import sys
+import time
+import argparse
+import subprocess
+import numpy as np
+from cli import SUBCOMMANDS
+from subjects import build_registry, get_registry
+
+
+def get_imports(module: str) -> str:
+    """Gets the top-level import statements of a module (i.e. those run as soon as it is imported)"""
+    with open(f"{module}.py") as file:
+        tree = ast.parse(file.read())
+    imports = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return "\n".join(ast.unparse(node) for node in imports) or "pass"
+
+
+def time_python(code: str, repeats: int) -> float:
+    """Median time (in seconds) for a fresh interpreter to run some code"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def time_function(function, repeats: int) -> float:
+    """Median time (in seconds) of calling a function"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the start-up time of each subcommand.")
+    parser.add_argument("--repeats", type=int, default=10, help="number of times each start-up is timed")
+    args = parser.parse_args()
+
+    baseline = time_python("pass", args.repeats)
+    print(f"Starting Python takes {baseline * 1000:.1f}ms, which isn't included below")
+
+    print(f"{'subcommand':>10} {'imports ms':>11}")
+    print(f"{'(cli.py)':>10} {(time_python('import cli', args.repeats) - baseline) * 1000:>11.1f}")
+    for name, (module, _) in SUBCOMMANDS.items():
+        try:
+            import_time = time_python(get_imports(module), args.repeats) - baseline
+            print(f"{name:>10} {import_time * 1000:>11.1f}")
+        except subprocess.CalledProcessError:
+            print(f"{name:>10} {'missing dependencies':>11}")
+
+    get_registry()  # so that the compiled registry exists
+    print(f"\nParsing subjects.csv: {time_function(build_registry, args.repeats) * 1e6:.1f}us, "
+          f"loading the compiled registry: {time_function(get_registry.__wrapped__, args.repeats) * 1e6:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Draws synthetic bar charts in the style of the subject reports, for benchmarking the parser.
+"""
+import os
+import numpy as np
+from PIL import Image, ImageDraw
+from image_parser import ImageParser
+from constants import NUMBER_OF_INTERVALS, NUMBER_OF_MARKS
+
+# dict mapping number of bars to number of intervals (axis-ticks)
+NUMBER_OF_TICKS = {number_of_bars: number_of_intervals
+                   for number_of_intervals, number_of_bars in NUMBER_OF_INTERVALS.items()}
+
+
+def draw_chart(number_of_bars: int, width: int = 800, height: int = 450, noise: float = 0.0, seed: int = 0):
+    """
+    Draws a bar chart with a random height for each bar.
+    Noise is the standard deviation of the gaussian noise added to every channel of every pixel.
+    Returns the image and the percentage of each bar (i.e. the expected score lookup).
+    """
+    random = np.random.default_rng(seed)
+    image = Image.new("RGB", (width, height), ImageParser.WHITE_PIXEL)
+    draw = ImageDraw.Draw(image)
+
+    # Plot area, leaving margins for the (undrawn) labels
+    left, right = int(width * 0.08), int(width * 0.97)
+    top, bottom = int(height * 0.05), int(height * 0.88)
+
+    # Axes (2px y-axis, 3px x-axis) and the axis-ticks below the x-axis
+    draw.rectangle([left - 2, top, left - 1, bottom + 2], fill=ImageParser.BLACK_PIXEL)
+    draw.rectangle([left, bottom, right, bottom + 2], fill=ImageParser.BLACK_PIXEL)
+    first_bar, last_bar = left + 10, right - 10
+    number_of_ticks = NUMBER_OF_TICKS[number_of_bars]
+    for tick in np.linspace(first_bar, last_bar, number_of_ticks).round().astype(int):
+        draw.rectangle([tick, bottom + 3, tick + 1, bottom + 8], fill=ImageParser.BLACK_PIXEL)
+
+    # Bars, touching the top of the x-axis
+    heights = random.integers(1, bottom - top, number_of_bars)
+    bar_width = (last_bar - first_bar) / (number_of_bars - 1)
+    for bar_x, bar_height in zip(np.linspace(first_bar, last_bar, number_of_bars), heights):
+        draw.rectangle([round(bar_x - bar_width * 0.35), bottom - bar_height, round(bar_x + bar_width * 0.35), bottom - 1],
+                       fill=ImageParser.BLUE_PIXEL)
+
+    if noise > 0:
+        pixels = np.asarray(image).astype(np.float32) + random.normal(0, noise, (height, width, 3))
+        image = Image.fromarray(pixels.clip(0, 255).round().astype(np.uint8))
+
+    return image, (heights / heights.sum()).tolist()
+
+
+def write_charts(images_folder: str, number_of_charts: int, width: int = 800, height: int = 450,
+                 noise: float = 0.0, seed: int = 0):
+    """
+    Writes charts into subject folders the same way as 1_extract_images.py,
+    with an Internals, Externals and Total chart for each subject.
+    """
+    data_types = ["Internals", "Externals", "Total"]
+    pages = {"Internals": 5, "Externals": 9, "Total": 10}
+    for index in range(number_of_charts):
+        subject_folder = f"{images_folder}/subject{index // len(data_types):04}_22"
+        data_type = data_types[index % len(data_types)]
+        if not os.path.exists(subject_folder):
+            os.makedirs(subject_folder)
+
+        # The Total is out of 100 marks, but is drawn with the 51 bars that NUMBER_OF_INTERVALS expects
+        number_of_bars = NUMBER_OF_MARKS[False][data_type] + 1 if data_type != "Total" else 51
+        image, _ = draw_chart(number_of_bars, width, height, noise, seed + index)
+        image.save(f"{subject_folder}/{data_type}-page{pages[data_type]:02}-img01.png")
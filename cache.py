@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+from settings import CACHE_FOLDER_NAME, CACHE_MAX_ENTRIES
+
+try:
+    import fcntl    # only on Unix, elsewhere concurrent saves aren't locked (the last one to finish wins)
+except ImportError:
+    fcntl = None
+
+
+class ResultCache:
+    """
+    Persistent cache of parsed charts, keyed by the hash of each image's contents.
+    The whole cache is discarded if it was saved with different parser settings (see ImageParser.get_settings_hash).
+    Once there are more than max_entries results, the least recently used ones are evicted.
+    Several processes (e.g. shards) can share the cache: each save merges in what the others have saved since.
+    """
+    def __init__(self, settings_hash: str, filename: str = f"{CACHE_FOLDER_NAME}/results.json",
+                 max_entries: int = CACHE_MAX_ENTRIES):
+        self.settings_hash = settings_hash
+        self.filename = filename
+        self.max_entries = max_entries
+
+        self.entries = {}   # dict mapping content hash to cached result
+        self.hits = 0
+        self.misses = 0
+
+        self.load()
+
+    @staticmethod
+    def hash_file(filename: str) -> str:
+        """Hashes the contents of a file"""
+        file_hash = hashlib.sha256()
+        with open(filename, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    @staticmethod
+    def hash_bytes(data: bytes) -> str:
+        """Hashes the contents of an image which isn't a file (e.g. the raw stream of a chart in a subject report)"""
+        return hashlib.sha256(data).hexdigest()
+
+    def read(self, verbose: bool = True) -> dict:
+        """Reads the entries saved with the same parser settings. An unreadable cache counts as empty"""
+        if not os.path.exists(self.filename):
+            return {}
+
+        try:
+            with open(self.filename) as file:
+                cache = json.load(file)
+            settings_hash, entries = cache["settings_hash"], cache["entries"]
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            if verbose:
+                print(f"WARNING: Could not read the cache {self.filename}, so it is treated as empty: {error!r}")
+            return {}
+
+        if settings_hash != self.settings_hash:
+            if verbose:
+                print(f"Parser settings have changed. Discarding {len(entries)} cached results.")
+            return {}
+        return entries
+
+    def load(self):
+        self.entries = self.read()
+
+    def get(self, content_hash: str):
+        """
+        Returns the cached (score lookup, number of intervals, tick spacing) for an image, or None if it isn't cached.
+        The tick spacing is None for results cached before it was recorded.
+        """
+        entry = self.entries.get(content_hash)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        entry["last_used"] = time.time()
+        score_lookup = {raw_score: percentage for raw_score, percentage in enumerate(entry["percentages"])}
+        return score_lookup, entry["intervals"], entry.get("tick_spacing")
+
+    def put(self, content_hash: str, score_lookup: dict, number_of_intervals: int, tick_spacing: float = None):
+        self.entries[content_hash] = {
+            "percentages": list(score_lookup.values()),     # raw scores are always 0, 1, 2, ...
+            "intervals": number_of_intervals,
+            "tick_spacing": tick_spacing,
+            "last_used": time.time()
+        }
+
+    def save(self):
+        folder_name = os.path.dirname(self.filename)
+        if folder_name:
+            os.makedirs(folder_name, exist_ok=True)
+
+        with open(f"{self.filename}.lock", 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)   # released when the lock file is closed
+
+            # Keep the results other processes have saved since this cache was loaded
+            for content_hash, entry in self.read(verbose=False).items():
+                if content_hash not in self.entries or entry["last_used"] > self.entries[content_hash]["last_used"]:
+                    self.entries[content_hash] = entry
+
+            # Evict the least recently used results
+            if len(self.entries) > self.max_entries:
+                by_last_used = sorted(self.entries, key=lambda content_hash: self.entries[content_hash]["last_used"])
+                for content_hash in by_last_used[:len(self.entries) - self.max_entries]:
+                    del self.entries[content_hash]
+
+            # Write to a temporary file of its own first so that a crash (or another process) can't leave
+            # a half-written cache
+            descriptor, temporary_filename = tempfile.mkstemp(suffix=".tmp", prefix=os.path.basename(self.filename),
+                                                              dir=folder_name or ".")
+            try:
+                with os.fdopen(descriptor, 'w') as file:
+                    json.dump({"settings_hash": self.settings_hash, "entries": self.entries}, file)
+                os.replace(temporary_filename, self.filename)
+            except BaseException:
+                os.remove(temporary_filename)
+                raise
@@ -0,0 +1,38 @@
+"""
+One entry point for every stage of the pipeline, e.g. python cli.py analyse --workers 4
+Only the script of the chosen subcommand is imported (and run, with the rest of the arguments),
+so listing the subcommands or running a light one never pays for NumPy, PIL, pikepdf or torch.
+"""
+import sys
+import runpy
+import argparse
+
+# dict mapping subcommand to (module, description)
+SUBCOMMANDS = {
+    "codes": ("0_get_subject_codes", "write the code of each subject"),
+    "extract": ("1_extract_images", "extract the charts from the subject reports"),
+    "analyse": ("2_analyse_images", "analyse the extracted charts into percentage data"),
+    "process": ("3_process_data", "make the percentages cumulative and organise them by year"),
+    "subjects": ("4_get_subjects_by_year", "write the subjects available in each year"),
+    "pipeline": ("run_pipeline", "run every stage which is out of date"),
+    "predict": ("predictor", "predict external raw scores for every row of a CSV"),
+    "fbcnn": ("fbcnn", "convert JPEG charts to PNGs, cleaning low quality ones (needs torch)"),
+}
+
+
+def main(args: list = None):
+    subcommands = "\n".join(f"  {name:<10}{description}" for name, (_, description) in SUBCOMMANDS.items())
+    parser = argparse.ArgumentParser(description="Runs a stage of the pipeline.", epilog=f"subcommands:\n{subcommands}",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("subcommand", choices=SUBCOMMANDS, metavar="subcommand")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments of the subcommand (see its --help)")
+    args = parser.parse_args(args)
+
+    module, _ = SUBCOMMANDS[args.subcommand]
+    sys.argv = [f"{module}.py", *args.args]
+    # Run as __main__ (like python -m) so that worker processes can find the script's functions
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+
+
+if __name__ == "__main__":
+    main()
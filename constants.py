@@ -57,3 +57,23 @@ NUMBER_OF_MARKS = {
         "Externals": 25
     }
 }
+
+
+# Used to recognise the charts in a subject report without decoding them.
+# Images narrower than this (in pixels) or with a different aspect ratio (width / height) are ignored
+CHART_MIN_WIDTH = 300
+CHART_ASPECT_RATIO = (1.2, 4.0)
+
+
+# The number of marks the Total (internals + externals) is out of
+TOTAL_MARKS = 100
+
+
+# How large each check of validation.py can get before a chart is considered suspicious
+ANOMALY_THRESHOLDS = {
+    "tick_spacing": 0.1,        # a gap between intervals 10% different to the median gap
+    "interior_zero_bars": 1,    # an empty bar between non-empty bars
+    "percentage_total": 0.01,   # percentages not adding up to 100%
+    "year_divergence": 0.2,     # a cumulative percentage 20% away from the same subject in other years
+    "total_mismatch": 0.03,     # a mean total 3% of TOTAL_MARKS away from the mean internal + mean external
+}
@@ -0,0 +1,132 @@
+"""
+Debug output of ImageParser (when ImageParser.DEBUG is on). Each chart gets its own files in DEBUG_FOLDER_NAME,
+named after the chart: the quantised image with what the parser found drawn over it, and the score lookup as CSV.
+The overlay is drawn with array operations on the palette indices of the quantised image, and every file is written
+by a background thread (which finishes any pending writes before the process exits), so parsing barely slows down.
+"""
+from __future__ import annotations
+import os
+import csv
+import numpy as np
+from typing import TYPE_CHECKING
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from pdf_images import get_subject_folder
+from settings import DEBUG_FOLDER_NAME
+
+if TYPE_CHECKING:
+    from image_parser import ImageParser
+
+# Palette indices of the overlay, after the white, black and blue of the quantised image
+AXIS_INDEX = 3      # the axes and the outline of the plot area
+TICK_INDEX = 4      # the intervals found on the x-axis
+SAMPLE_INDEX = 5    # the blue pixels counted in the columns sampled for each bar
+OVERLAY_COLOURS = [
+    (0, 200, 0),    # AXIS_INDEX
+    (255, 0, 255),  # TICK_INDEX
+    (255, 0, 0),    # SAMPLE_INDEX
+]
+
+# At most this many charts are waiting to be written at once, which caps the memory used if writing falls behind
+MAX_PENDING = 32
+
+executor = None     # runs the background thread, only made once something is written
+pending = []        # futures of the writes which haven't finished yet
+
+
+def get_debug_name(filename: str) -> str:
+    """
+    Gets where the debug output of a chart is written (without the extension) from the filename given to ImageParser,
+    e.g. images/accounting_22/Internals-page05-img01.png (or pdfs/snr_accounting_22_subj_rpt.pdf:Internals-page05-img01
+    for a chart read straight from a subject report) -> debug/accounting_22/Internals-page05-img01
+    """
+    pdf_filename, _, image_name = filename.rpartition(":")
+    if pdf_filename.endswith(".pdf"):
+        folder = get_subject_folder(pdf_filename)
+    else:
+        folder = os.path.basename(os.path.dirname(filename))
+        image_name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(DEBUG_FOLDER_NAME, folder, image_name)
+
+
+def draw_overlay(image_parser: ImageParser) -> np.ndarray:
+    """
+    Draws what the parser found so far over the palette indices of its quantised image (so it also shows how far
+    a chart got before failing): the axes, the plot area, the intervals and the blue pixels counted for each bar.
+    Anything outside of the image (e.g. from a chart which failed because of it) isn't drawn.
+    """
+    overlay = image_parser.pixels.copy()
+    height, width = overlay.shape
+    if 0 < image_parser.y_axis < width:
+        overlay[:, image_parser.y_axis] = AXIS_INDEX
+    if 0 < image_parser.x_axis < height:
+        overlay[image_parser.x_axis, :] = AXIS_INDEX
+    if image_parser.plot_area is not None:
+        left, upper, right, lower = np.clip(image_parser.plot_area, 0, [width, height, width, height])
+        if left < right and upper < lower:
+            overlay[[upper, lower - 1], left:right] = AXIS_INDEX
+            overlay[upper:lower, [left, right - 1]] = AXIS_INDEX
+    intervals = np.asarray(image_parser.intervals, dtype=int)
+    intervals = intervals[(intervals >= 0) & (intervals < width)]
+    if len(intervals) and 0 <= image_parser.x_axis < height:
+        # Only below the x-axis, where the tick marks are
+        overlay[image_parser.x_axis + 1:, intervals] = TICK_INDEX
+    if image_parser.bars_height and image_parser.plot_area is not None:
+        # The same columns as get_bar_height
+        _, upper, _, lower = np.clip(image_parser.plot_area, 0, [width, height, width, height])
+        columns = np.clip(image_parser.get_bar_columns(), 0, width - 1).reshape(-1)
+        samples = overlay[upper:lower, columns]
+        samples[samples == 2] = SAMPLE_INDEX
+        overlay[upper:lower, columns] = samples
+    return overlay
+
+
+def write_files(debug_name: str, palette: list, overlay: np.ndarray, score_lookup: dict):
+    """Writes the debug output of one chart (on the background thread)"""
+    try:
+        os.makedirs(os.path.dirname(debug_name) or ".", exist_ok=True)
+        image = Image.fromarray(overlay)
+        image.putpalette(palette + [value for colour in OVERLAY_COLOURS for value in colour])
+        # Barely compressed, since the writer only keeps up if encoding is quick
+        image.save(f"{debug_name}_overlay.png.tmp", format="PNG", compress_level=1)
+        os.replace(f"{debug_name}_overlay.png.tmp", f"{debug_name}_overlay.png")
+
+        if score_lookup:
+            with open(f"{debug_name}_lookup.csv.tmp", 'w', newline='') as file:
+                writer = csv.writer(file)
+                for percentile in score_lookup.values():
+                    writer.writerow([percentile])
+            os.replace(f"{debug_name}_lookup.csv.tmp", f"{debug_name}_lookup.csv")
+    except Exception as error:
+        print(f"WARNING: Could not write the debug output of {debug_name}: {error!r}")
+
+
+def write_debug_output(image_parser: ImageParser):
+    """Queues the debug output of a parsed (or failed) chart to be written by the background thread"""
+    global executor
+    if getattr(image_parser, "pixels", None) is None:   # failed before it was quantised, so there is nothing to show
+        return
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="debug_output")
+
+    # Only wait once too many charts are pending (backpressure)
+    pending[:] = [future for future in pending if not future.done()]
+    if len(pending) >= MAX_PENDING:
+        pending.pop(0).result()
+
+    # Called while the parser may be handling an error, so drawing must never raise one of its own
+    try:
+        overlay = draw_overlay(image_parser)
+    except Exception as error:
+        print(f"WARNING: Could not draw the debug output of {image_parser.filename}: {error!r}")
+        return
+
+    palette = [*image_parser.WHITE_PIXEL, *image_parser.BLACK_PIXEL, *image_parser.BLUE_PIXEL]
+    pending.append(executor.submit(write_files, get_debug_name(image_parser.filename), palette, overlay,
+                                   dict(image_parser.score_lookup)))
+
+
+def flush():
+    """Waits until all of the debug output queued so far has been written"""
+    while pending:
+        pending.pop(0).result()
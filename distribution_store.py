@@ -0,0 +1,100 @@
+"""
+A compact binary format for the cumulative distributions written by 3_process_data.py,
+which can be memory-mapped so that single lookups don't need the whole file to be read.
+
+Layout: MAGIC, the length of the header (little-endian uint64), the header as JSON (padded to 8 bytes),
+then every distribution as a contiguous array of little-endian float64 indexed by raw score.
+The header maps "data type/year/subject code" to the (offset, length) of its array.
+float64 is used (rather than float32) so that the values round-trip exactly with the JSON files.
+"""
+import os
+import json
+import struct
+import numpy as np
+
+MAGIC = b"DISTRIB1"
+DTYPE = np.dtype("<f8")
+
+
+def get_key(data_type: str, year, subject_code) -> str:
+    return f"{data_type}/{year}/{subject_code}"
+
+
+def write_store(filename: str, distributions: dict):
+    """
+    Writes distributions in the same structure as internals.json/externals.json,
+    but with an extra level for the data type (i.e. data type -> year -> subject code -> raw score -> percentage).
+    """
+    entries = {}
+    arrays = []
+    offset = 0
+    for data_type, years in distributions.items():
+        for year, subjects in years.items():
+            for subject_code, subject_data in subjects.items():
+                # raw scores are always 0, 1, 2, ... so only the percentages are stored
+                array = np.array([subject_data[raw_score] for raw_score in sorted(subject_data, key=int)], dtype=DTYPE)
+                entries[get_key(data_type, year, subject_code)] = [offset, len(array)]
+                arrays.append(array)
+                offset += len(array)
+
+    header = json.dumps({"entries": entries}).encode()
+    header += b" " * (-len(header) % 8)     # so that the data is aligned
+
+    with open(f"{filename}.tmp", 'wb') as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<Q", len(header)))
+        file.write(header)
+        for array in arrays:
+            file.write(array.tobytes())
+
+    # Replace the old file in one step so that readers never see a half-written store
+    os.replace(f"{filename}.tmp", filename)
+
+
+class DistributionStore:
+    """Reads a file written by write_store. Only the header is read up front, the data is memory-mapped"""
+    def __init__(self, filename: str):
+        with open(filename, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{filename} is not a distribution store")
+            header_length, = struct.unpack("<Q", file.read(8))
+            self.entries = json.loads(file.read(header_length))["entries"]
+
+        data_offset = len(MAGIC) + 8 + header_length
+        number_of_values = sum(length for _, length in self.entries.values())
+        self.data = np.memmap(filename, dtype=DTYPE, mode="r", offset=data_offset, shape=(number_of_values,)) \
+            if number_of_values > 0 else np.zeros(0, dtype=DTYPE)
+
+    def __contains__(self, key: tuple) -> bool:
+        return get_key(*key) in self.entries
+
+    def keys(self):
+        """Yields (data type, year, subject code) of every distribution"""
+        for key in self.entries:
+            yield tuple(key.split("/"))
+
+    def get(self, data_type: str, year, subject_code) -> np.ndarray:
+        """Gets the cumulative percentage of each raw score (a read-only view of the file)"""
+        offset, length = self.entries[get_key(data_type, year, subject_code)]
+        return self.data[offset:offset + length]
+
+    def lookup(self, data_type: str, year, subject_code, raw_score: int) -> float:
+        """Gets the cumulative percentage of a single raw score"""
+        offset, length = self.entries[get_key(data_type, year, subject_code)]
+        if not 0 <= raw_score < length:
+            raise KeyError(f"Raw score {raw_score} not in {get_key(data_type, year, subject_code)}")
+        return float(self.data[offset + raw_score])
+
+    def lookup_range(self, data_type: str, year, subject_code, start: int, stop: int) -> np.ndarray:
+        """Gets the cumulative percentages of the raw scores from start up to (but not including) stop"""
+        return np.array(self.get(data_type, year, subject_code)[start:stop])
+
+    def to_dict(self, data_type: str) -> dict:
+        """Gets the distributions of a data type in the same structure as internals.json/externals.json"""
+        distributions = {}
+        for key_data_type, year, subject_code in self.keys():
+            if key_data_type == data_type:
+                percentages = self.get(data_type, year, subject_code).tolist()
+                distributions.setdefault(year, {})[subject_code] = \
+                    {str(raw_score): percentage for raw_score, percentage in enumerate(percentages)}
+        return distributions
@@ -0,0 +1,116 @@
+"""
+Cumulative distributions of every subject, stored as the rows of one array so that they can be built
+with one cumsum and queried for many students (across any number of subjects) at once.
+"""
+import numpy as np
+from constants import TOTAL_MARKS
+
+DATA_TYPES = ["Internals", "Externals", "Total"]
+
+
+class Distributions:
+    def __init__(self, keys: list, percentages: list, is_cumulative: bool = False):
+        """
+        keys is a list of (data type, year, subject code) and percentages is a list of the percentage
+        of students who got each raw score (in order of raw score), for each key.
+        If is_cumulative is True, the percentages have already been made cumulative.
+        """
+        self.keys = [(data_type, str(year), str(subject_code)) for data_type, year, subject_code in keys]
+        self.rows = {key: row for row, key in enumerate(self.keys)}     # dict mapping key to its row
+        self.lengths = np.array([len(subject_percentages) for subject_percentages in percentages], dtype=np.intp)
+
+        # Pad every subject to the same number of raw scores so that they can all be summed at once
+        padded = np.zeros((len(percentages), self.lengths.max(initial=0)))
+        for row, subject_percentages in enumerate(percentages):
+            padded[row, :len(subject_percentages)] = subject_percentages
+        self.cumulative = padded if is_cumulative else np.cumsum(padded, axis=1)
+
+    @classmethod
+    def from_data(cls, data: dict, subject_codes: dict):
+        """
+        Builds the distributions from the data written by 2_analyse_images.py
+        (i.e. data type -> subject folder (e.g. accounting_22) -> raw score -> percentage).
+        """
+        keys = []
+        percentages = []
+        for data_type, subjects in data.items():
+            for subject, subject_data in subjects.items():
+                subject_name = subject[:-3]
+                year = "20" + subject[-2:]
+                keys.append((data_type, year, subject_codes[subject_name]))
+                percentages.append([subject_data[raw_score] for raw_score in sorted(subject_data, key=int)])
+        return cls(keys, percentages)
+
+    @classmethod
+    def from_cumulative(cls, distributions: dict):
+        """
+        Loads distributions which are already cumulative, as written by 3_process_data.py
+        (i.e. data type -> year -> subject code -> raw score -> cumulative percentage).
+        """
+        keys = []
+        percentages = []
+        for data_type, years in distributions.items():
+            for year, subjects in years.items():
+                for subject_code, subject_data in subjects.items():
+                    keys.append((data_type, year, subject_code))
+                    percentages.append([subject_data[raw_score] for raw_score in sorted(subject_data, key=int)])
+        return cls(keys, percentages, is_cumulative=True)
+
+    def to_dict(self, data_type: str) -> dict:
+        """Gets the distributions of a data type as year -> subject code -> raw score -> cumulative percentage"""
+        distributions = {}
+        for row, (key_data_type, year, subject_code) in enumerate(self.keys):
+            if key_data_type == data_type:
+                cumulative = self.cumulative[row, :self.lengths[row]].tolist()
+                distributions.setdefault(year, {})[subject_code] = \
+                    {str(raw_score): percentage for raw_score, percentage in enumerate(cumulative)}
+        return distributions
+
+    def get_rows(self, data_type: str, years, subject_codes, missing: int = None) -> np.ndarray:
+        """
+        Gets the row of each (year, subject code). Years and subject codes can be single values or arrays.
+        Subjects without data raise a KeyError, unless missing is given, in which case they get that instead.
+        """
+        years, subject_codes = np.broadcast_arrays(np.asarray(years).astype(str), np.asarray(subject_codes).astype(str))
+        # Only look up each distinct subject once
+        pairs, inverse = np.unique(np.char.add(np.char.add(years, "/"), subject_codes), return_inverse=True)
+        unique_rows = []
+        for pair in pairs:
+            year, subject_code = pair.split("/")
+            if (data_type, year, subject_code) not in self.rows and missing is None:
+                raise KeyError(f"No {data_type} data for subject {subject_code} in {year}")
+            unique_rows.append(self.rows.get((data_type, year, subject_code), missing))
+        return np.array(unique_rows, dtype=np.intp)[inverse.reshape(years.shape)]
+
+    def percentile_for_score(self, data_type: str, years, subject_codes, scores) -> np.ndarray:
+        """Gets the cumulative percentage (i.e. percentile) of each raw score"""
+        rows = self.get_rows(data_type, years, subject_codes)
+        scores = np.asarray(scores, dtype=np.intp)
+        if np.any((scores < 0) | (scores >= self.lengths[rows])):
+            raise ValueError("Raw score out of range")
+        return self.cumulative[rows, scores]
+
+    def score_for_percentile(self, data_type: str, years, subject_codes, percentiles) -> np.ndarray:
+        """Gets the lowest raw score whose cumulative percentage is at least each percentile"""
+        rows = self.get_rows(data_type, years, subject_codes)
+        percentiles = np.broadcast_to(np.asarray(percentiles, dtype=float), rows.shape)
+        scores = np.empty(rows.shape, dtype=np.intp)
+        # searchsorted works on one distribution at a time, so search each distinct subject once for all its students
+        for row in np.unique(rows):
+            students = rows == row
+            scores[students] = np.searchsorted(self.cumulative[row, :self.lengths[row]], percentiles[students])
+        return np.minimum(scores, self.lengths[rows] - 1)
+
+    def combined_percentile(self, years, subject_codes, internal_scores, external_scores) -> np.ndarray:
+        """
+        Gets the percentile of each student's total (internal + external) raw score from the Total distribution.
+        The Total charts cover 0 to TOTAL_MARKS with one bar for every (TOTAL_MARKS / (number of bars - 1)) marks.
+        Each bar is labelled with the lowest total it covers (e.g. with 51 bars, bar 3 is the totals 6 and 7),
+        so a total is always rounded down to the bar below it.
+        """
+        rows = self.get_rows("Total", years, subject_codes)
+        totals = np.asarray(internal_scores) + np.asarray(external_scores)
+        if np.any((totals < 0) | (totals > TOTAL_MARKS)):
+            raise ValueError("Total raw score out of range")
+        bars = (totals * (self.lengths[rows] - 1) // TOTAL_MARKS).astype(np.intp)
+        return self.cumulative[rows, bars]
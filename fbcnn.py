@@ -1,87 +1,284 @@
-"""To be used in Google Colab"""
+"""
+Optional stage between 1_extract_images.py and 2_analyse_images.py (see DENOISE_IMAGES in settings.py),
+which turns the charts extracted as JPEGs (into the subject folders of IMAGES_FOLDER_NAME, next to the PNGs)
+into PNGs, which 2_analyse_images.py uses instead of the JPEGs.
+Only the charts whose estimated JPEG quality is below FBCNN_QUALITY_THRESHOLD have their artifacts removed by FBCNN
+(https://github.com/jiaxi-jiang/FBCNN), the rest are only converted.
+The model is loaded once from FBCNN_MODEL_PATH and runs on batches of charts, while a pool of threads reads
+and writes the charts. torch and the FBCNN repository (for models.network_fbcnn) are only imported if a chart
+needs cleaning.
+"""
+from __future__ import annotations
+import os
+import sys
 import glob
-import os.path
-import logging
-import torch
-import cv2
-from utils import utils_logger
-from utils import utils_image as util
-import requests
-
-
-def main():
-    quality_factor = 90
-    input_path = "INPUT"
-    output_path = "OUTPUT"
-    model_name = 'fbcnn_color.pth'
-    n_channels = 3            # set 1 for grayscale image, set 3 for color image
-
-    nc = [64, 128, 256, 512]
-    nb = 4
-
-    result_name = model_name[:-4]
-    util.mkdir(output_path)
-
-    model_pool = 'model_zoo'  # fixed
-    model_path = os.path.join(model_pool, model_name)
-    if os.path.exists(model_path):
-        print(f'loading model from {model_path}')
-    else:
-        os.makedirs(os.path.dirname(model_path), exist_ok=True)
-        url = 'https://github.com/jiaxi-jiang/FBCNN/releases/download/v1.0/{}'.format(os.path.basename(model_path))
-        r = requests.get(url, allow_redirects=True)
-        print(f'downloading model {model_path}')
-        open(model_path, 'wb').write(r.content)
-
-    logger_name = result_name + '_qf_' + str(quality_factor)
-    utils_logger.logger_info(logger_name, log_path=os.path.join(output_path, logger_name+'.log'))
-    logger = logging.getLogger(logger_name)
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+import numpy as np
+from PIL import Image
+from settings import IMAGES_FOLDER_NAME, FBCNN_MODEL_PATH, FBCNN_QUALITY_THRESHOLD
 
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+if TYPE_CHECKING:
+    import torch
+
+MODEL_CHANNELS = [64, 128, 256, 512]
+MODEL_BLOCKS = 4
+
+# Luminance quantisation table of the JPEG standard (quality 50), which encoders scale to get other qualities
+STANDARD_LUMINANCE_TABLE = [
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+]
+
+
+def estimate_quality(image: Image.Image) -> float:
+    """
+    Estimates the quality (1 to 100) a JPEG was saved with from how much its luminance quantisation table is
+    scaled from the standard one (the inverse of libjpeg's scaling). Only the header is needed, not the pixels.
+    Images which aren't JPEGs are lossless so have a quality of 100.
+    """
+    tables = getattr(image, "quantization", None)
+    if not tables:
+        return 100.0
+    scale = 100 * sum(tables[0]) / sum(STANDARD_LUMINANCE_TABLE)
+    quality = 5000 / scale if scale > 100 else (200 - scale) / 2
+    return float(min(max(quality, 1), 100))
+
+
+def get_jobs(subject_folders: list = None, overwrite: bool = False) -> list:
+    """
+    Gets (JPEG filename, PNG filename) of every chart in the subject folders of IMAGES_FOLDER_NAME
+    (or only the given subject folders) whose PNG is missing or older than the JPEG (e.g. extracted again)
+    """
+    if subject_folders is None:
+        subject_folders = sorted(subject_folder for subject_folder in os.listdir(IMAGES_FOLDER_NAME)
+                                 if not subject_folder.startswith("."))     # Skip hidden folders
+    jobs = []
+    for subject_folder in subject_folders:
+        for jpeg_filename in sorted(glob.glob(f"{IMAGES_FOLDER_NAME}/{subject_folder}/*.jpg")):
+            png_filename = f"{os.path.splitext(jpeg_filename)[0]}.png"
+            if overwrite or not os.path.exists(png_filename) \
+                    or os.path.getmtime(png_filename) < os.path.getmtime(jpeg_filename):
+                jobs.append((jpeg_filename, png_filename))
+    return jobs
+
+
+def load_image(filename: str) -> np.ndarray:
+    with Image.open(filename) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+def save_image(filename: str, image: np.ndarray):
+    Image.fromarray(image).save(f"{filename}.tmp", format="PNG")
+    os.replace(f"{filename}.tmp", filename)
 
-    # ----------------------------------------
-    # load model
-    # ----------------------------------------
 
-    from models.network_fbcnn import FBCNN as net
-    model = net(in_nc=n_channels, out_nc=n_channels, nc=nc, nb=nb, act_mode='R')
-    model.load_state_dict(torch.load(model_path), strict=True)
+def convert_image(job: tuple):
+    """Writes a chart which doesn't need cleaning as a PNG as it is"""
+    jpeg_filename, png_filename = job
+    save_image(png_filename, load_image(jpeg_filename))
+
+
+def prefetch(function, items, workers: int, queue_size: int):
+    """
+    Like map, but runs the function on a thread pool ahead of time.
+    At most queue_size results are kept waiting so that memory use stays bounded.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        for item in items:
+            futures.append(executor.submit(function, item))
+            if len(futures) >= queue_size:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def get_tile_starts(length: int, tile_size: int, tile_overlap: int) -> list:
+    """Gets the start of each tile along one side of an image, so that the tiles overlap and cover the whole side"""
+    if length <= tile_size:
+        return [0]
+    return list(range(0, length - tile_size, tile_size - tile_overlap)) + [length - tile_size]
+
+
+def load_model(model_path: str, device: torch.device):
+    """Loads FBCNN (for colour images) once, ready to be shared by every batch"""
+    import torch
+    from models.network_fbcnn import FBCNN
+
+    model = FBCNN(in_nc=3, out_nc=3, nc=MODEL_CHANNELS, nb=MODEL_BLOCKS, act_mode='R')
+    model.load_state_dict(torch.load(model_path, map_location=device), strict=True)
     model.eval()
-    for k, v in model.named_parameters():
-        v.requires_grad = False
-    model = model.to(device)
-    logger.info('Model path: {:s}'.format(model_path))
-
-    input_folders = {}
-    for folder in os.listdir(input_path):
-        input_folders[folder] = glob.glob(f"{input_path}/{folder}/*")
-        if not os.path.exists(os.path.join(output_path, folder)):
-            os.mkdir(os.path.join(output_path, folder))
-    print(input_folders)
-
-    index = 1
-    for folder, image_paths in input_folders.items():
-        for image_path in image_paths:
-            img_name, ext = os.path.splitext(os.path.basename(image_path))
-            logger.info('{:->4d}--> {:>10s}'.format(index, img_name+ext))
-            image = util.imread_uint(image_path, n_channels=n_channels)
-
-            if n_channels == 3:
-                image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-            _, encimg = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), quality_factor])
-            image = cv2.imdecode(encimg, 0) if n_channels == 1 else cv2.imdecode(encimg, 3)
-            if n_channels == 3:
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            image = util.uint2tensor4(image)
-            image = image.to(device)
-
-            output_image, QF = model(image)
-            output_image = util.tensor2single(output_image)
-            output_image = util.single2uint(output_image)
-
-            util.imsave(output_image, os.path.join(output_path, folder, img_name+'.png'))
-            index += 1
+    for parameter in model.parameters():
+        parameter.requires_grad = False
+    return model.to(device)
+
+
+def run_model(model, images: list, device: torch.device) -> list:
+    """Runs the model on a batch of images of the same size. Returns the output images as floats (0 to 1)"""
+    import torch
+    batch = torch.from_numpy(np.stack(images)).permute(0, 3, 1, 2).float().div(255).to(device)
+    output_images, _ = model(batch)     # the model also predicts the quality of each image, which isn't needed
+    output_images = output_images.clamp(0, 1).permute(0, 2, 3, 1).cpu().numpy()
+    return list(output_images)
+
+
+def run_model_tiled(model, image: np.ndarray, device: torch.device, batch_size: int, tile_size: int,
+                    tile_overlap: int) -> np.ndarray:
+    """Runs the model on overlapping tiles of a large image (in batches), averaging the tiles where they overlap"""
+    height, width = image.shape[:2]
+    tiles = [(y, x) for y in get_tile_starts(height, tile_size, tile_overlap)
+             for x in get_tile_starts(width, tile_size, tile_overlap)]
+
+    output_image = np.zeros(image.shape, dtype=np.float32)
+    weight = np.zeros((height, width, 1), dtype=np.float32)
+    for start in range(0, len(tiles), batch_size):
+        batch = tiles[start:start + batch_size]
+        output_tiles = run_model(model, [image[y:y + tile_size, x:x + tile_size] for y, x in batch], device)
+        for (y, x), output_tile in zip(batch, output_tiles):
+            output_image[y:y + tile_size, x:x + tile_size] += output_tile
+            weight[y:y + tile_size, x:x + tile_size] += 1
+    return output_image / weight
+
+
+def to_uint8(image: np.ndarray) -> np.ndarray:
+    return np.round(image * 255).astype(np.uint8)
+
+
+def clean_images(jobs: list, model_path: str, batch_size: int = 8, tile_size: int = 512, tile_overlap: int = 32,
+                 workers: int = 4, torch_threads: int = None) -> dict:
+    """
+    Removes the JPEG artifacts of the charts with FBCNN and writes them as PNGs.
+    Charts of the same size are run through the model in batches of batch_size.
+    Charts larger than tile_size are split into overlapping tiles, which are batched instead.
+    Charts are read and written on workers threads while the model runs on torch_threads threads.
+    Returns a dict mapping JPEG filename to error for those which failed.
+    """
+    import torch
+
+    errors = {}
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    if torch_threads is not None:
+        torch.set_num_threads(torch_threads)
+    model = load_model(model_path, device)
+    print(f"Loaded FBCNN from {model_path} on {device}")
+
+    def load(job: tuple):
+        try:
+            return job, load_image(job[0])
+        except Exception as error:
+            return job, error
+
+    saving = {}     # dict mapping future to JPEG filename
+    with ThreadPoolExecutor(max_workers=workers) as saver, torch.inference_mode():
+        def save(job: tuple, output_image: np.ndarray):
+            saving[saver.submit(save_image, job[1], to_uint8(output_image))] = job[0]
+
+        def run_batch(batch: list):
+            try:
+                output_images = run_model(model, [image for _, image in batch], device)
+            except Exception as error:
+                errors.update((job[0], error) for job, _ in batch)
+                return
+            for (job, _), output_image in zip(batch, output_images):
+                save(job, output_image)
+
+        batches = {}    # dict mapping image size to the charts of that size waiting to be run
+        for job, image in prefetch(load, jobs, workers, queue_size=2 * batch_size):
+            if isinstance(image, Exception):
+                errors[job[0]] = image
+                continue
+
+            if image.shape[0] > tile_size or image.shape[1] > tile_size:
+                try:
+                    save(job, run_model_tiled(model, image, device, batch_size, tile_size, tile_overlap))
+                except Exception as error:
+                    errors[job[0]] = error
+                continue
+
+            batch = batches.setdefault(image.shape, [])
+            batch.append((job, image))
+            if len(batch) == batch_size:
+                run_batch(batches.pop(image.shape))
+            elif sum(len(waiting) for waiting in batches.values()) > 4 * batch_size:
+                # Too many different sizes are waiting, so run the largest group early to limit memory use
+                run_batch(batches.pop(max(batches, key=lambda size: len(batches[size]))))
+
+        for batch in batches.values():
+            run_batch(batch)
+
+    for future, jpeg_filename in saving.items():
+        if future.exception() is not None:
+            errors[jpeg_filename] = future.exception()
+    return errors
+
+
+def main(subject_folders: list = None, threshold: float = FBCNN_QUALITY_THRESHOLD, model_path: str = FBCNN_MODEL_PATH,
+         overwrite: bool = False, workers: int = 4, batch_size: int = 8, tile_size: int = 512, tile_overlap: int = 32,
+         torch_threads: int = None) -> bool:
+    if not os.path.exists(IMAGES_FOLDER_NAME):
+        print(f"ERROR: No folder called {IMAGES_FOLDER_NAME} found.")
+        return False
+
+    # Only the headers are read to estimate the quality, so every chart can be sorted before any is decoded
+    errors = {}
+    to_clean, to_convert = [], []
+    for job in get_jobs(subject_folders, overwrite):
+        try:
+            with Image.open(job[0]) as image:
+                quality = estimate_quality(image)
+        except Exception as error:
+            errors[job[0]] = error
+            continue
+        (to_clean if quality < threshold else to_convert).append(job)
+    print(f"{len(to_clean)} chart(s) with a quality below {threshold:g} to clean, {len(to_convert)} to convert")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for job, future in [(job, executor.submit(convert_image, job)) for job in to_convert]:
+            if future.exception() is not None:
+                errors[job[0]] = future.exception()
+
+    if to_clean:
+        if not os.path.exists(model_path):
+            print(f"ERROR: No FBCNN model found at {model_path}. Download fbcnn_color.pth from "
+                  f"https://github.com/jiaxi-jiang/FBCNN/releases to it.")
+            return False
+        errors.update(clean_images(to_clean, model_path, batch_size, tile_size, tile_overlap, workers, torch_threads))
+
+    if errors:
+        print(f"ERROR: {len(errors)} chart(s) could not be converted:")
+        for filename, error in sorted(errors.items()):
+            print(f"    {filename}: {error!r}")
+    return not errors
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Converts the charts extracted as JPEGs into PNGs, removing the "
+                                                 "artifacts of low quality ones with FBCNN.")
+    parser.add_argument("subject_folders", nargs="*",
+                        help=f"subject folders to convert (defaults to every folder in {IMAGES_FOLDER_NAME})")
+    parser.add_argument("--threshold", type=float, default=FBCNN_QUALITY_THRESHOLD,
+                        help="charts with a lower estimated JPEG quality (1 to 100) are cleaned, the rest converted")
+    parser.add_argument("--model", default=FBCNN_MODEL_PATH, help="path of fbcnn_color.pth")
+    parser.add_argument("--overwrite", action="store_true", help="convert the charts again even if their PNG exists")
+    parser.add_argument("--workers", type=int, default=4, help="number of threads reading and writing charts")
+    parser.add_argument("--batch-size", type=int, default=8, help="number of charts run through the model at once")
+    parser.add_argument("--tile-size", type=int, default=512,
+                        help="charts larger than this are run through the model in overlapping tiles")
+    parser.add_argument("--tile-overlap", type=int, default=32, help="number of pixels by which the tiles overlap")
+    parser.add_argument("--torch-threads", type=int, default=None,
+                        help="number of threads the model runs on without a GPU (defaults to torch's own choice)")
+    args = parser.parse_args()
+    if not 0 <= args.tile_overlap < args.tile_size:
+        parser.error("--tile-overlap must be at least 0 and less than --tile-size")
+    if not main(args.subject_folders or None, args.threshold, args.model, args.overwrite, args.workers,
+                args.batch_size, args.tile_size, args.tile_overlap, args.torch_threads):
+        sys.exit(1)
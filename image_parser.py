@@ -0,0 +1,444 @@
+import json
+import time
+import hashlib
+import functools
+import numpy as np
+from PIL import Image
+import debug_output
+from constants import NUMBER_OF_INTERVALS
+
+# Increase whenever a change to ImageParser changes the parsed results, so that every cached result is parsed again
+PARSER_VERSION = 2
+
+
+def first_frequent_index(values: np.ndarray, min_count: int):
+    """
+    Returns the index of the first element whose value has been seen more than min_count times,
+    i.e. the point at which a running frequency count of the values would first exceed min_count.
+    Returns None if no value is frequent enough.
+    """
+    if len(values) == 0:
+        return None
+
+    _, inverse = np.unique(values, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # Number the occurrences of each value (0 for the first sighting, 1 for the second, etc.)
+    order = np.argsort(inverse, kind="stable")
+    sorted_inverse = inverse[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_inverse[1:] != sorted_inverse[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(values)])
+    occurrences = np.empty(len(values), dtype=np.int64)
+    occurrences[order] = np.arange(len(values)) - np.repeat(group_starts, group_sizes)
+
+    # The (min_count + 1)th sighting is the first time the frequency exceeds min_count
+    hits = np.flatnonzero(occurrences == min_count)
+    if len(hits) == 0:
+        return None
+    return int(hits[0])
+
+
+def get_scan_chunks(length: int, first_chunk_size: int):
+    """
+    Yields (start, stop) of chunks which cover range(length) in order. Each chunk is twice the size of the last,
+    so that scans which stop early only look at a little more than they need to,
+    while scans which go all the way still only take a few steps.
+    """
+    start, chunk_size = 0, first_chunk_size
+    while start < length:
+        yield start, min(start + chunk_size, length)
+        start += chunk_size
+        chunk_size *= 2
+
+
+@functools.lru_cache()
+def get_palette_lookup(palette: tuple) -> np.ndarray:
+    """
+    Builds a table mapping every colour to the index of its nearest colour in the palette.
+    PIL only uses the top 6 bits of each channel when matching a colour to a palette, so the table has 64^3 entries
+    (indexed by r >> 2 << 12 | g >> 2 << 6 | b >> 2) and is made by quantising one colour of each entry with PIL.
+    """
+    levels = np.arange(0, 256, 4, dtype=np.uint8)
+    red, green, blue = np.meshgrid(levels, levels, levels, indexing="ij")
+    colours = np.stack([red, green, blue], axis=-1).reshape(64 * 64, 64, 3)
+
+    image_palette = Image.new("P", (len(palette) // 3, 1))
+    image_palette.putpalette(palette)
+    quantised = Image.fromarray(colours).quantize(colors=len(palette) // 3, palette=image_palette,
+                                                  dither=Image.Dither.NONE)
+    return np.asarray(quantised, dtype=np.uint8).reshape(-1)
+
+
+def classify_pixels(image: Image.Image, palette: tuple, rows_per_chunk: int = 32) -> np.ndarray:
+    """
+    Maps each pixel of an RGB image to the index of its nearest colour in the palette (the same as PIL's quantize).
+    The image is classified a few rows at a time so that the intermediate arrays stay in the CPU cache.
+    """
+    rgb = np.asarray(image)
+    lookup = get_palette_lookup(palette)
+    pixels = np.empty(rgb.shape[:2], dtype=np.uint8)
+    for y in range(0, rgb.shape[0], rows_per_chunk):
+        # Combine the top 6 bits of each channel into one index of the lookup table
+        chunk = rgb[y:y + rows_per_chunk] >> 2
+        colour_index = chunk[..., 0].astype(np.uint32) << 12
+        colour_index |= chunk[..., 1].astype(np.uint32) << 6
+        colour_index |= chunk[..., 2]
+        np.take(lookup, colour_index, out=pixels[y:y + rows_per_chunk])
+    return pixels
+
+
+class ImageParser:
+    # Parsers are made for every chart, so only these attributes are allowed (no per-instance __dict__)
+    __slots__ = [
+        "filename", "image_original", "image", "pixels",
+        "y_axis", "x_axis", "plot_area", "intervals", "tick_spacing", "bars_x", "bars_height", "bars", "score_lookup",
+        "stage_times", "pixels_visited", "warnings",
+    ]
+
+    """Settings"""
+    DEBUG = False
+
+    WHITE_PIXEL = (255, 255, 255)  # index of 0
+    BLACK_PIXEL = (2, 2, 2)        # index of 1
+    BLUE_PIXEL = (165, 199, 233)  # index of 2
+
+    # A rough guide on how thick the x-axis is
+    X_AXIS_WIDTH = 4
+    # How rows of consecutive black pixels (with same x position)
+    # need to be counted for it to be considered the y-axis
+    # and vice versa for x-axis
+    AXIS_MIN_COUNT = 15
+
+    # Translate the x-axis down this many pixels in case it is not perfectly smooth
+    X_AXIS_OFFSET = 1
+
+    # Quantise with PIL's quantize rather than the lookup table in classify_pixels. Both give identical results,
+    # but PIL is faster on whole images (see benchmarks/quantise.py), so the lookup table is only used if this is off
+    QUANTISE_WITH_PIL = True
+
+    # How many rows (or columns) are scanned at first when searching for the axes and the plot area
+    # (see get_scan_chunks). Scanning stops as soon as every row/column has been found,
+    # so mostly only the edges of large images are examined
+    SCAN_CHUNK_SIZE = 64
+
+    # Measure the height of each bar to a fraction of a pixel, from how far the colour of its anti-aliased top edge
+    # is between white and blue (across the middle half of the bar), rather than only counting the pixels which
+    # quantise to blue. Keeps the original image until the bars have been measured
+    SUBPIXEL_HEIGHTS = False
+
+    def __init__(self, filename: str, image: Image.Image = None):
+        """Init"""
+        self.filename = filename    # if an image is given, this is only used to identify it in messages
+        self.image_original = image if image is not None else Image.open(filename)    # only kept until quantised
+
+        """Variables"""
+        self.y_axis = 0         # the x-coordinate of the y-axis (from the right-most black pixel)
+        self.x_axis = 0         # the y-coordinate of the x-axis (from the bottom-most black pixel)
+        self.plot_area = None   # (left, upper, right, lower) of the part of the image between the axes with any bars
+        self.intervals = []     # the x-coordinates of the intervals on the x-axis
+        self.tick_spacing = 0.0     # largest difference between a gap between intervals and the median gap (relative)
+        self.bars_x = []        # the x-coordinates (centre) of the bars in the graph
+        self.bars_height = {}   # dict mapping x-coordinate (centre) of bars to their height
+        self.bars = {}          # dict mapping x-coordinate (centre) of bars to their percentage (actually decimal)
+        self.score_lookup = {}  # dict mapping raw score to percentage
+
+        """Metrics"""
+        self.stage_times = {}       # dict mapping each method to how long it took (in seconds)
+        self.pixels_visited = {}    # dict mapping each method to how many pixels it examined
+        self.warnings = []          # structured records of every warning and error (see warn)
+
+        """Methods"""
+        try:
+            self.image = self.run_stage(self.preprocess_image)
+            self.pixels = np.asarray(self.image, dtype=np.uint8)   # palette indices, indexed by [y, x]
+            # Every later stage only uses the quantised image, so the (up to 4 times larger) original is released
+            if not self.SUBPIXEL_HEIGHTS:
+                self.image_original = None
+
+            for stage in [
+                self.locate_y_axis,
+                self.locate_x_axis,
+                self.locate_plot_area,
+                self.locate_intervals,
+                self.locate_bars,
+                self.get_bar_height,
+                self.calculate_bar_percentages,
+                self.get_score_mapping,
+            ]:
+                self.run_stage(stage)
+        except Exception as error:
+            error.metrics = self.get_metrics()  # so that the warnings leading up to a failure aren't lost
+            raise
+        finally:
+            if self.DEBUG:
+                debug_output.write_debug_output(self)
+
+    def run_stage(self, stage):
+        """Runs one of the methods, recording how long it took"""
+        start = time.perf_counter()
+        try:
+            return stage()
+        finally:
+            self.stage_times[stage.__name__] = time.perf_counter() - start
+
+    def warn(self, kind: str, message: str, **details):
+        """Prints a warning (or error) and records it, along with any details, in the metrics of the image"""
+        print(message)
+        self.warnings.append({"kind": kind, "message": message, **details})
+
+    def get_metrics(self) -> dict:
+        """Gets the timings, pixel counts and warnings of the image (which can be written as JSON)"""
+        return {
+            "filename": self.filename,
+            "total_time": sum(self.stage_times.values()),
+            "stage_times": dict(self.stage_times),
+            "pixels_visited": dict(self.pixels_visited),
+            "warnings": list(self.warnings),
+        }
+
+    @classmethod
+    def get_settings_hash(cls) -> str:
+        """Hashes every setting which affects the parsed results (so that cached results can be invalidated)"""
+        settings = [
+            PARSER_VERSION,
+            cls.WHITE_PIXEL,
+            cls.BLACK_PIXEL,
+            cls.BLUE_PIXEL,
+            cls.X_AXIS_WIDTH,
+            cls.AXIS_MIN_COUNT,
+            cls.X_AXIS_OFFSET,
+            cls.SUBPIXEL_HEIGHTS,
+            sorted(NUMBER_OF_INTERVALS.items()),
+        ]
+        return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+    def preprocess_image(self):
+        palette = [
+            # ORDER MATTERS HERE
+            *self.WHITE_PIXEL,  # index of 0
+            *self.BLACK_PIXEL,  # index of 1
+            *self.BLUE_PIXEL,   # index of 2
+        ]
+
+        image = self.image_original
+        self.pixels_visited["preprocess_image"] = image.width * image.height
+
+        image_colours = image.getpalette("RGB") if image.mode == "P" else None
+        if image_colours is not None:
+            # Palette images (e.g. from an Indexed PDF image) are classified by their palette alone,
+            # then each pixel looks up the class of its palette entry without being decoded to RGB
+            colours = np.array(image_colours, dtype=np.uint8).reshape(1, -1, 3)
+            classes = np.zeros(256, dtype=np.uint8)
+            classes[:colours.shape[1]] = classify_pixels(Image.fromarray(colours), tuple(palette))[0]
+            quantised_image = Image.fromarray(classes[np.asarray(image)])
+            quantised_image.putpalette(palette)
+        elif image.mode == "RGB" and not self.QUANTISE_WITH_PIL:
+            quantised_image = Image.fromarray(classify_pixels(image, tuple(palette)))
+            quantised_image.putpalette(palette)
+        else:
+            image_palette = Image.new("P", (3, 1))
+            image_palette.putpalette(palette)
+            quantised_image = image.quantize(colors=3, palette=image_palette, dither=Image.Dither.NONE)
+
+        return quantised_image
+
+    def locate_y_axis(self):
+        """Finds the x-coordinate of the right-most pixel of the y-axis"""
+        height, width = self.pixels.shape
+        first_black = np.full(height, -1)   # x-coord of the first black pixel in each row
+        group_end = np.full(height, -1)     # x-coord of the first white pixel after it (-1 if not found yet)
+        searching = np.arange(height)       # rows without a black pixel so far
+        in_group = np.arange(0)             # rows in their first group of black pixels
+        self.pixels_visited["locate_y_axis"] = 0
+
+        # Scan a few columns at a time from the left, only looking at the rows which haven't been found yet
+        for left, right in get_scan_chunks(width, self.SCAN_CHUNK_SIZE):
+            if len(searching) > 0:
+                black = self.pixels[searching, left:right] == 1
+                self.pixels_visited["locate_y_axis"] += black.size
+                found = black.any(axis=1)
+                first_black[searching[found]] = left + black.argmax(axis=1)[found]
+                in_group = np.r_[in_group, searching[found]]
+                searching = searching[~found]
+
+            if len(in_group) > 0:
+                after_group = (self.pixels[in_group, left:right] != 1) & \
+                              (np.arange(left, right) > first_black[in_group][:, None])
+                self.pixels_visited["locate_y_axis"] += after_group.size
+                found = after_group.any(axis=1)
+                group_end[in_group[found]] = left + after_group.argmax(axis=1)[found]
+                in_group = in_group[~found]
+
+            if len(searching) == 0 and len(in_group) == 0:
+                break
+
+        # x-coord of the first white pixel after the first consecutive group of black pixels in each row
+        last_black_pixels = group_end[group_end >= 0]
+
+        # find the first x-coord to have many black pixels end on it (i.e. vertical line = y-axis)
+        index = first_frequent_index(last_black_pixels, self.AXIS_MIN_COUNT)
+        if index is not None:
+            self.y_axis = int(last_black_pixels[index])
+            if self.y_axis / self.image.width > 0.2:    # y-axis should be roughly in left-most 20% of image
+                self.warn("y_axis_position",
+                          f"WARNING: Possibly invalid y-axis position ({self.y_axis}) in {self.filename}",
+                          position=self.y_axis)
+            return self.y_axis
+
+        self.warn("y_axis_missing", "ERROR: Couldn't locate y-axis")
+
+    def locate_x_axis(self):
+        """Finds the y-coordinate of the bottom of the x-axis"""
+        # the top row is never scanned
+        region = self.pixels[1:, self.y_axis:]
+        first_black_pixels = np.full(region.shape[1], -1)   # y-coord of the bottom-most black pixel in each column
+        remaining = np.arange(region.shape[1])              # columns without a black pixel so far
+        self.pixels_visited["locate_x_axis"] = 0
+
+        # Scan a few rows at a time from the bottom, only looking at the columns which haven't been found yet
+        for start, stop in get_scan_chunks(region.shape[0], self.SCAN_CHUNK_SIZE):
+            top, bottom = region.shape[0] - stop, region.shape[0] - start
+            black_from_bottom = (region[top:bottom, remaining] == 1)[::-1]
+            self.pixels_visited["locate_x_axis"] += black_from_bottom.size
+            found = black_from_bottom.any(axis=0)
+            # +1 because the region starts from the second row
+            first_black_pixels[remaining[found]] = bottom - black_from_bottom.argmax(axis=0)[found]
+            remaining = remaining[~found]
+            if len(remaining) == 0:
+                break
+
+        # y-coord of the first black pixel in each column (starting from bottom)
+        first_black_pixels = first_black_pixels[first_black_pixels >= 0]
+
+        # find the first y-coord to have many columns end on it (i.e. horizontal line = x-axis)
+        index = first_frequent_index(first_black_pixels, self.AXIS_MIN_COUNT)
+        if index is not None:
+            self.x_axis = (int(first_black_pixels[index]) + 1  # +1 because it needs to be the pixel before the first black pixel
+                           + self.X_AXIS_OFFSET)    # extra offset for safety
+            if self.x_axis / self.image.height < 0.8:   # x-axis should be in roughly bottom 20% of image
+                self.warn("x_axis_position",
+                          f"WARNING: Possibly invalid x-axis position ({self.x_axis}) in {self.filename}",
+                          position=self.x_axis)
+            return self.x_axis
+
+        self.warn("x_axis_missing", "ERROR: Couldn't locate x-axis")
+
+    def locate_plot_area(self):
+        """Finds the part of the image containing the bars, from the axes and the top-most blue pixel between them"""
+        # Starts one column before the y-axis since the left column of the first bar can be there
+        left, bottom = max(self.y_axis - 1, 0), max(self.x_axis - self.X_AXIS_WIDTH, 0)
+        upper = bottom
+        self.pixels_visited["locate_plot_area"] = 0
+
+        # Scan a few rows at a time from the top, stopping at the first one with any blue
+        for top, stop in get_scan_chunks(bottom, self.SCAN_CHUNK_SIZE):
+            blue = self.pixels[top:stop, left:] == 2
+            self.pixels_visited["locate_plot_area"] += blue.size
+            has_blue = blue.any(axis=1)
+            if has_blue.any():
+                upper = top + int(has_blue.argmax())
+                break
+
+        self.plot_area = (left, upper, self.image.width, bottom)
+
+    def locate_intervals(self):
+        """Locates the x-coordinates (left-most pixel) of the axis-ticks of the x-axis"""
+        black = self.pixels[self.x_axis, self.y_axis:] == 1
+        self.pixels_visited["locate_intervals"] = black.size
+        # only the first pixel of each group of consecutive black pixels is counted
+        group_starts = black & ~np.r_[False, black[:-1]]
+        self.intervals = (np.flatnonzero(group_starts) + self.y_axis).tolist()
+
+        # Checks that the intervals are fairly evenly spaced
+        differences = np.ediff1d(self.intervals)
+        median_diff = np.median(differences)
+        for i in differences:
+            discrepancy = abs(i - median_diff)
+            if discrepancy > 1:
+                self.warn("interval_discrepancy",
+                          f"WARNING: Possibly invalid position of interval (discrepancy of {discrepancy}) in {self.filename}",
+                          discrepancy=float(discrepancy))
+        if len(differences) > 0 and median_diff > 0:
+            self.tick_spacing = float(np.abs(differences - median_diff).max() / median_diff)
+
+        # Checks that the number of intervals found is valid
+        if len(self.intervals) not in NUMBER_OF_INTERVALS:
+            self.warn("interval_count",
+                      f"ERROR: Invalid number of intervals ({len(self.intervals)}) in {self.filename}. SKIPPING",
+                      intervals=len(self.intervals))
+
+    def locate_bars(self):
+        """Locates the x-coordinates (center) of each bar"""
+        num_bars = NUMBER_OF_INTERVALS[len(self.intervals)]
+        self.bars_x = np.round(np.linspace(self.intervals[0], self.intervals[-1], num_bars)).astype(int)
+
+    def get_bar_columns(self) -> np.ndarray:
+        """Gets the x-coordinates of the columns which are measured in each bar (indexed by [bar, column])"""
+        if self.SUBPIXEL_HEIGHTS:
+            # The middle half of the space given to each bar
+            bar_spacing = (self.bars_x[-1] - self.bars_x[0]) / max(len(self.bars_x) - 1, 1)
+            half_width = max(int(bar_spacing / 4), 1)
+            return np.clip(self.bars_x[:, None] + np.arange(-half_width, half_width + 1), 0, self.image.width - 1)
+        # 3 columns in the bar to prevent outliers
+        return self.bars_x[:, None] + np.arange(-1, 2)
+
+    def get_bar_height(self):
+        # Take the median of the columns of each bar
+        columns = self.get_bar_columns()
+        # Only the plot area is scanned since there is no blue above it
+        _, upper, _, lower = self.plot_area
+        blue = self.pixels[upper:lower, columns] == 2   # indexed by [y - upper, bar, column]
+        self.pixels_visited["get_bar_height"] = blue.size
+        heights = blue.sum(axis=0)
+
+        if self.SUBPIXEL_HEIGHTS:
+            median_heights = np.median(heights + self.get_edge_fractions(columns, blue), axis=1)
+        else:
+            median_heights = np.median(heights, axis=1).astype(int)
+        self.bars_height = dict(zip(self.bars_x, median_heights.tolist()))
+
+    def get_edge_fractions(self, columns: np.ndarray, blue: np.ndarray) -> np.ndarray:
+        """
+        Gets how much the height of each column (indexed by [bar, column]) should change to account for the
+        anti-aliased top edge of its bar, given which pixels of the plot area are blue (indexed by [y - upper, bar,
+        column]). The top blue pixel and the pixel above it are read from the original image, and each is given how
+        far its colour is between white (0) and blue (1): the top pixel counts as that fraction rather than 1,
+        and the pixel above (which quantised to white) adds its fraction.
+        Columns without any blue only add the fraction of the pixel where the other bars start.
+        """
+        _, upper, _, lower = self.plot_area
+        has_bar = blue.any(axis=0)
+        tops = upper + blue.argmax(axis=0)
+        # The bars start just above the x-axis, however thick it is
+        bottoms = lower - 1 - blue[::-1].argmax(axis=0)
+        base = int(np.median(bottoms[has_bar])) if has_bar.any() else lower - 1
+        tops = np.where(has_bar, tops, base + 1)
+        rows = np.stack([np.maximum(tops - 1, 0), np.minimum(tops, self.pixels.shape[0] - 1)])    # above, top
+
+        # Only the rows and columns around the top edges are decoded from the original image
+        left, top = int(columns.min()), int(rows.min())
+        region = self.image_original.crop((left, top, int(columns.max()) + 1, int(rows.max()) + 1))
+        if region.mode != "RGB":
+            region = region.convert("RGB")
+        colours = np.asarray(region)[rows - top, columns - left].astype(np.float32)   # indexed by [0/1, bar, column]
+        self.pixels_visited["get_bar_height"] += rows.size
+        self.image_original = None
+
+        # Project each colour onto the line from white to blue. Black pixels (e.g. ticks) aren't part of any bar
+        white, blue_colour = np.array(self.WHITE_PIXEL, dtype=np.float32), np.array(self.BLUE_PIXEL, dtype=np.float32)
+        direction = (white - blue_colour) / np.dot(white - blue_colour, white - blue_colour)
+        blueness = np.clip((white - colours) @ direction, 0, 1)
+        blueness[self.pixels[rows, columns] == 1] = 0
+
+        return blueness[0] + np.where(has_bar, blueness[1] - 1, 0)
+
+    def calculate_bar_percentages(self):
+        """Convert height of each bar to percentage"""
+        total_height = sum(self.bars_height.values())
+        for bar_x, height in self.bars_height.items():
+            self.bars[bar_x] = height / total_height
+
+    def get_score_mapping(self):
+        """Enumerate the bars to convert them into their corresponding raw score"""
+        for raw_score, percentage in enumerate(self.bars.values()):
+            self.score_lookup[raw_score] = percentage
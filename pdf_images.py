@@ -0,0 +1,188 @@
+"""
+pikepdf is only imported by the functions which read PDFs (and for type checking),
+so that the filename helpers can be used without paying for its import.
+"""
+from __future__ import annotations
+import os
+import json
+import hashlib
+from typing import TYPE_CHECKING
+from constants import IMAGES_DIRECTORY, CHART_MIN_WIDTH, CHART_ASPECT_RATIO
+from settings import EXTRACT_ALL_IMAGES, PDF_INDEX_FOLDER_NAME, IMAGES_FOLDER_NAME
+
+if TYPE_CHECKING:
+    from pikepdf import Pdf
+
+DATA_TYPES = ["Internals", "Externals", "Total"]
+
+# Increase whenever build_index changes, so that every saved index is rebuilt
+INDEX_VERSION = 2
+
+
+def get_year(filename: str) -> int:
+    """Gets the year of a subject report from its filename (e.g. snr_accounting_22_subj_rpt.pdf is 2022)"""
+    return int("20" + filename[filename.index("_subj_rpt") - 2: filename.index("_subj_rpt")])
+
+
+def get_subject_folder(filename: str) -> str:
+    """Gets the name of the subject (e.g. accounting_22) as used in the analysed data"""
+    return os.path.basename(filename).replace("snr_", "").replace("_subj_rpt", "").replace(".pdf", "")
+
+
+def get_folder_name(filename: str) -> str:
+    """Gets the folder which the charts of a subject report are extracted to (e.g. images/accounting_22)"""
+    return f"{IMAGES_FOLDER_NAME}/{get_subject_folder(filename)}"
+
+
+def get_page_categories(pdf: Pdf, year: int) -> dict:
+    """Gets a dict mapping each graph type to the page number it is on"""
+    if not EXTRACT_ALL_IMAGES:
+        return IMAGES_DIRECTORY[year]
+    return {f"Unknown{page_num}": page_num for page_num in range(1, len(pdf.pages) + 1)}
+
+
+def get_drawn_images(page) -> list:
+    """
+    Gets (name, image data) of each image of a page in the order its content stream draws them
+    (page.images is sorted by name instead, so /Im10 comes before /Im9), then any which aren't drawn directly
+    """
+    from pikepdf import parse_content_stream
+    images = dict(page.images.items())
+    names = []
+    for operands, _ in parse_content_stream(page, "Do"):
+        name = str(operands[0])
+        if name in images and name not in names:
+            names.append(name)
+    names += [name for name in images if name not in names]
+    return [(name, images[name]) for name in names]
+
+
+def get_page_images(pdf: Pdf, page_categories: dict):
+    """Yields (graph type, page number, image index, image) for every image on the page of each graph type"""
+    from pikepdf import PdfImage
+    for graph_type, page_number in page_categories.items():
+        page = pdf.pages[page_number - 1]
+
+        if len(page.images) < 1:    # if a page has no images, try the previous one instead
+            page = pdf.pages[page_number - 2]
+
+        for image_index, (_, image_data) in enumerate(get_drawn_images(page)):
+            yield graph_type, page_number, image_index, PdfImage(image_data)
+
+
+def get_image_name(graph_type: str, page_number: int, image_index: int) -> str:
+    """Gets the filename (without extension) that an extracted image is saved as"""
+    return f"{graph_type}-page{page_number:02}-img{image_index + 1:02}"
+
+
+def get_image_page(image_filename: str) -> int:
+    """Gets the page number from the name of an extracted image (see get_image_name), or None if it has none"""
+    parts = os.path.basename(image_filename).split("-")
+    if len(parts) < 3 or not parts[-2].startswith("page") or not parts[-2][4:].isdigit():
+        return None
+    return int(parts[-2][4:])
+
+
+def is_chart_like(image_data) -> bool:
+    """Checks whether an image could be one of the charts from its dimensions and colour space alone"""
+    from pikepdf import Name, Array
+    if image_data.get("/ImageMask", False):
+        return False
+
+    width, height = int(image_data.Width), int(image_data.Height)
+    if width < CHART_MIN_WIDTH or not CHART_ASPECT_RATIO[0] <= width / height <= CHART_ASPECT_RATIO[1]:
+        return False
+
+    # The charts are blue so they need to be in colour
+    colour_space = image_data.get("/ColorSpace")
+    if colour_space in (Name.DeviceRGB, Name.CalRGB):
+        return True
+    if isinstance(colour_space, Array) and len(colour_space) > 0:
+        if colour_space[0] == Name.ICCBased:
+            return int(colour_space[1].get("/N", 0)) == 3
+        if colour_space[0] == Name.Indexed:
+            return True
+    return False
+
+
+def build_index(pdf: Pdf, year: int = None) -> dict:
+    """
+    Finds the page number and name of the Internals, Externals and Total charts, without decoding any images.
+    If the year is in IMAGES_DIRECTORY, the charts on (or just before) its pages are preferred.
+    Otherwise, the chart-like images are assumed to be in the order of DATA_TYPES.
+    """
+    candidates = []     # list of (page number, image index, name, width, height) in the order they're drawn
+    for page_number, page in enumerate(pdf.pages, start=1):
+        for image_index, (name, image_data) in enumerate(get_drawn_images(page)):
+            if is_chart_like(image_data):
+                candidates.append((page_number, image_index, str(name), int(image_data.Width), int(image_data.Height)))
+
+    charts = {}
+    page_hints = IMAGES_DIRECTORY.get(year, {})
+    for data_type, page_number in page_hints.items():
+        # if a page has no charts, try the previous one instead
+        for hinted_page in (page_number, page_number - 1):
+            on_page = [candidate for candidate in candidates if candidate[0] == hinted_page]
+            if on_page:
+                charts[data_type] = on_page[0]
+                candidates.remove(on_page[0])
+                break
+
+    # Any data type without a hint (or whose hint didn't work) takes the next chart after the previous data type
+    data_types = list(page_hints) or DATA_TYPES
+    previous_chart = (0, 0)
+    for data_type in data_types:
+        if data_type not in charts:
+            following = [candidate for candidate in candidates if candidate[:2] > previous_chart]
+            if not following:
+                continue
+            charts[data_type] = following[0]
+            candidates.remove(following[0])
+        previous_chart = charts[data_type][:2]
+
+    return {data_type: dict(zip(["page", "image_index", "name", "width", "height"], chart))
+            for data_type, chart in charts.items()}
+
+
+def get_index_settings_hash() -> str:
+    """Hashes everything build_index depends on besides the report, so that indexes are rebuilt when it changes"""
+    settings = [INDEX_VERSION, CHART_MIN_WIDTH, list(CHART_ASPECT_RATIO), sorted(IMAGES_DIRECTORY.items())]
+    return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+
+def get_index(filename: str, pdf: Pdf) -> dict:
+    """
+    Gets the index of the charts of a subject report (see build_index).
+    Each index is saved in PDF_INDEX_FOLDER_NAME and only rebuilt when the report or the settings it uses change.
+    """
+    index_filename = f"{PDF_INDEX_FOLDER_NAME}/{os.path.basename(filename)}.json"
+    stat = os.stat(filename)
+    settings_hash = get_index_settings_hash()
+    if os.path.exists(index_filename):
+        with open(index_filename) as file:
+            index = json.load(file)
+        if index["size"] == stat.st_size and index["mtime"] == stat.st_mtime \
+                and index.get("settings_hash") == settings_hash:
+            return index["charts"]
+
+    try:
+        year = get_year(filename)
+    except ValueError:
+        year = None
+    charts = build_index(pdf, year)
+
+    if not os.path.exists(PDF_INDEX_FOLDER_NAME):
+        os.makedirs(PDF_INDEX_FOLDER_NAME, exist_ok=True)
+    with open(f"{index_filename}.tmp", 'w') as file:
+        json.dump({"size": stat.st_size, "mtime": stat.st_mtime, "settings_hash": settings_hash, "charts": charts},
+                  file, indent=4)
+    os.replace(f"{index_filename}.tmp", index_filename)
+    return charts
+
+
+def get_chart_images(filename: str, pdf: Pdf):
+    """Yields (data type, page number, image index, image) for each chart in the index of a subject report"""
+    from pikepdf import PdfImage
+    for data_type, chart in get_index(filename, pdf).items():
+        image_data = pdf.pages[chart["page"] - 1].images[chart["name"]]
+        yield data_type, chart["page"], chart["image_index"], PdfImage(image_data)
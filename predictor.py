@@ -0,0 +1,115 @@
+"""
+Predicts external raw scores from internal raw scores by matching percentiles,
+i.e. a student is predicted the lowest external score whose percentile is at least their internal percentile.
+Every (year, subject) is turned into a lookup table (internal raw score -> predicted external raw score) when loaded,
+so predicting for any number of students is a single array lookup.
+Can be used on a CSV with the columns year, subject_code and internal_score, e.g.
+python predictor.py students.csv predictions.csv
+"""
+import os
+import csv
+import json
+import argparse
+import itertools
+import numpy as np
+from distributions import Distributions
+from distribution_store import DistributionStore
+from settings import OUTPUT_FOLDER_NAME, DISTRIBUTION_STORE_NAME
+
+INPUT_COLUMNS = ["year", "subject_code", "internal_score"]
+OUTPUT_COLUMN = "predicted_external"
+
+
+class Predictor:
+    def __init__(self, distributions: Distributions):
+        """Distributions must contain the Internals and Externals of every subject to be predicted"""
+        self.distributions = distributions
+
+        # One row of the table for every row of the distributions (only the Internals rows are used).
+        # -1 marks raw scores that don't exist and subjects without an Externals distribution
+        self.table = np.full(distributions.cumulative.shape, -1, dtype=np.intp)
+        for (data_type, year, subject_code), row in distributions.rows.items():
+            external_row = distributions.rows.get(("Externals", year, subject_code))
+            if data_type != "Internals" or external_row is None:
+                continue
+            internal = distributions.cumulative[row, :distributions.lengths[row]]
+            external = distributions.cumulative[external_row, :distributions.lengths[external_row]]
+            # The last percentiles may be slightly above 1 due to floating point error, so are clipped to the top score
+            self.table[row, :len(internal)] = np.minimum(np.searchsorted(external, internal),
+                                                         distributions.lengths[external_row] - 1)
+
+    @classmethod
+    def from_output(cls, output_folder: str = OUTPUT_FOLDER_NAME):
+        """Loads the distributions written by 3_process_data.py, from the distribution store if there is one"""
+        store_filename = f"{output_folder}/{DISTRIBUTION_STORE_NAME}.bin"
+        distributions = {}
+        if os.path.exists(store_filename):
+            store = DistributionStore(store_filename)
+            for data_type in ["Internals", "Externals"]:
+                distributions[data_type] = store.to_dict(data_type)
+        else:
+            for data_type in ["Internals", "Externals"]:
+                with open(f"{output_folder}/{data_type.lower()}.json") as file:
+                    distributions[data_type] = json.load(file)
+        return cls(Distributions.from_cumulative(distributions))
+
+    def predict(self, years, subject_codes, internal_scores, missing: int = None) -> np.ndarray:
+        """
+        Predicts the external raw score of each student. Arguments can be single values or arrays.
+        Subjects without data and raw scores out of range raise an error,
+        unless missing is given, in which case those students are predicted missing instead.
+        """
+        rows = self.distributions.get_rows("Internals", years, subject_codes,
+                                           missing=-1 if missing is not None else None)
+        internal_scores = np.asarray(internal_scores, dtype=np.intp)
+        valid = (rows >= 0) & (internal_scores >= 0) & (internal_scores < self.distributions.lengths[rows])
+        predictions = np.where(valid, self.table[rows, np.where(valid, internal_scores, 0)], -1)
+        if np.any(predictions < 0):
+            if missing is None:
+                raise ValueError("Raw score out of range or subject without Externals data")
+            predictions[predictions < 0] = missing
+        return predictions
+
+    def predict_csv(self, input_filename: str, output_filename: str, chunk_size: int = 100000) -> int:
+        """
+        Predicts every row of a CSV, reading and writing chunk_size rows at a time so that any number of rows
+        can be predicted in constant memory. The prediction is added as a new column, left empty for rows
+        which can't be predicted. Returns the number of rows predicted.
+        """
+        number_of_rows = 0
+        with open(input_filename, newline="") as input_file, open(output_filename, 'w', newline="") as output_file:
+            reader = csv.reader(input_file)
+            writer = csv.writer(output_file)
+            header = next(reader)
+            try:
+                columns = [header.index(column) for column in INPUT_COLUMNS]
+            except ValueError:
+                raise ValueError(f"{input_filename} must have the columns {', '.join(INPUT_COLUMNS)}")
+            writer.writerow(header + [OUTPUT_COLUMN])
+
+            while chunk := list(itertools.islice(reader, chunk_size)):
+                years, subject_codes, internal_scores = (np.array([row[column] for row in chunk]) for column in columns)
+                scores = np.char.strip(internal_scores)
+                is_number = np.char.isdigit(scores)
+                predictions = self.predict(np.char.strip(years), np.char.strip(subject_codes),
+                                           np.where(is_number, scores, "-1").astype(np.intp), missing=-1)
+                writer.writerows(row + [str(prediction) if prediction >= 0 else ""]
+                                 for row, prediction in zip(chunk, predictions.tolist()))
+                number_of_rows += len(chunk)
+        return number_of_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predicts external raw scores for every row of a CSV.")
+    parser.add_argument("input", help=f"CSV with the columns {', '.join(INPUT_COLUMNS)}")
+    parser.add_argument("output", help=f"CSV to write, with the extra column {OUTPUT_COLUMN}")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="number of rows predicted at a time")
+    args = parser.parse_args()
+
+    predictor = Predictor.from_output()
+    number_of_rows = predictor.predict_csv(args.input, args.output, args.chunk_size)
+    print(f"Predicted {number_of_rows} row(s)")
+
+
+if __name__ == "__main__":
+    main()
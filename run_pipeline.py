@@ -0,0 +1,183 @@
+"""
+Runs every stage of the pipeline in order, skipping any stage whose inputs haven't changed since it last ran.
+The hashes of the inputs of each stage are recorded in a manifest in the output folder.
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from cache import ResultCache
+from pdf_images import get_folder_name
+from settings import PDFS_FOLDER_NAME, IMAGES_FOLDER_NAME, OUTPUT_FOLDER_NAME, JSON_DATA_NAME, \
+    DISTRIBUTION_STORE_NAME, VALIDATION_REPORT_NAME, DENOISE_IMAGES
+
+MANIFEST_FILENAME = f"{OUTPUT_FOLDER_NAME}/manifest.json"
+
+# Inputs may be glob patterns. Each script is an input of its own stage so that code changes re-run it.
+STAGES = [
+    {
+        "script": "0_get_subject_codes.py",
+        "inputs": ["subjects.csv", "subjects.py"],
+        "outputs": [f"{OUTPUT_FOLDER_NAME}/subject_codes.json"],
+    },
+    {
+        # Run separately for each subject report, see extract_images
+        "script": "1_extract_images.py",
+        "inputs": [f"{PDFS_FOLDER_NAME}/*.pdf", "pdf_images.py", "constants.py"],
+        "outputs": [IMAGES_FOLDER_NAME],
+    },
+    *([{
+        # Optional, and only the charts without an up-to-date PNG are converted
+        "script": "fbcnn.py",
+        "inputs": [f"{IMAGES_FOLDER_NAME}/*/*.jpg"],
+        "outputs": [],
+    }] if DENOISE_IMAGES else []),
+    {
+        # Only the charts which aren't in the result cache are analysed again
+        "script": "2_analyse_images.py",
+        "inputs": [f"{IMAGES_FOLDER_NAME}/*/*.png", f"{IMAGES_FOLDER_NAME}/*/*.jpg", "image_parser.py",
+                   "validation.py", "constants.py"],
+        "outputs": [f"{OUTPUT_FOLDER_NAME}/{JSON_DATA_NAME}.json",
+                    f"{OUTPUT_FOLDER_NAME}/{VALIDATION_REPORT_NAME}.json"],
+    },
+    {
+        "script": "3_process_data.py",
+        "inputs": [f"{OUTPUT_FOLDER_NAME}/subject_codes.json", f"{OUTPUT_FOLDER_NAME}/{JSON_DATA_NAME}.json",
+                   "distributions.py", "distribution_store.py", "constants.py"],
+        "outputs": [f"{OUTPUT_FOLDER_NAME}/internals.json", f"{OUTPUT_FOLDER_NAME}/externals.json",
+                    f"{OUTPUT_FOLDER_NAME}/totals.json", f"{OUTPUT_FOLDER_NAME}/{DISTRIBUTION_STORE_NAME}.bin"],
+    },
+    {
+        "script": "4_get_subjects_by_year.py",
+        "inputs": ["subjects.csv", "subjects.py", "constants.py", f"{OUTPUT_FOLDER_NAME}/internals.json",
+                   f"{OUTPUT_FOLDER_NAME}/externals.json"],
+        "outputs": [f"{OUTPUT_FOLDER_NAME}/all_subjects.json", f"{OUTPUT_FOLDER_NAME}/math_science_subjects.json"],
+    },
+]
+
+
+class Manifest:
+    """Records the size, modification time and hash of the inputs of each stage when it last ran successfully"""
+    def __init__(self, filename: str = MANIFEST_FILENAME):
+        self.filename = filename
+        self.stages = {}    # dict mapping stage to dict mapping input filename to its fingerprint
+
+        if os.path.exists(filename):
+            with open(filename) as file:
+                self.stages = json.load(file)
+
+    def fingerprint(self, stage: str, filename: str) -> dict:
+        """Gets the fingerprint of a file, only hashing it again if its size or modification time has changed"""
+        stat = os.stat(filename)
+        previous = self.stages.get(stage, {}).get(filename)
+        if previous is not None and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+            return previous
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "hash": ResultCache.hash_file(filename)}
+
+    def fingerprints(self, stage: str, filenames: list) -> dict:
+        return {filename: self.fingerprint(stage, filename) for filename in filenames}
+
+    def is_changed(self, stage: str, fingerprints: dict) -> bool:
+        previous = self.stages.get(stage, {})
+        return {filename: fingerprint["hash"] for filename, fingerprint in fingerprints.items()} \
+            != {filename: fingerprint["hash"] for filename, fingerprint in previous.items()}
+
+    def record(self, stage: str, fingerprints: dict):
+        self.stages.setdefault(stage, {}).update(fingerprints)
+        self.save()
+
+    def save(self):
+        with open(f"{self.filename}.tmp", 'w') as file:
+            json.dump(self.stages, file, indent=4)
+        os.replace(f"{self.filename}.tmp", self.filename)
+
+
+def get_inputs(stage: dict) -> list:
+    filenames = []
+    for pattern in stage["inputs"]:
+        filenames.extend(sorted(glob.glob(pattern)))
+    return filenames
+
+
+def run_script(script: str, *args) -> bool:
+    print(f"Running {script} {' '.join(args)}".strip())
+    return subprocess.run([sys.executable, script, *args]).returncode == 0
+
+
+def extract_images(stage: dict, manifest: Manifest, workers: int = None, force: bool = False) -> bool:
+    """Extracts the charts of each subject report which is new or has changed, several reports at a time"""
+    script = stage["script"]
+    inputs = get_inputs(stage)
+    shared_inputs = [filename for filename in inputs if not filename.endswith(".pdf")] + [script]
+    shared_fingerprints = manifest.fingerprints(f"{script}:shared", shared_inputs)
+    shared_changed = force or manifest.is_changed(f"{script}:shared", shared_fingerprints)
+
+    pdf_fingerprints = {}   # dict mapping subject report to its fingerprint, for every report which needs extracting
+    for filename in inputs:
+        if not filename.endswith(".pdf"):
+            continue
+        fingerprint = manifest.fingerprints(f"{script}:{filename}", [filename])
+        if shared_changed or manifest.is_changed(f"{script}:{filename}", fingerprint) \
+                or not os.path.exists(get_folder_name(filename)):
+            pdf_fingerprints[filename] = fingerprint
+
+    if not pdf_fingerprints and not shared_changed:
+        print(f"Skipping {script} since no subject reports have changed.")
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Each report has its own process already, so they don't need to start a pool of their own
+        successful = list(executor.map(lambda filename: run_script(script, filename, "--overwrite", "--workers", "1"),
+                                       pdf_fingerprints))
+
+    for (filename, fingerprint), was_successful in zip(pdf_fingerprints.items(), successful):
+        if was_successful:
+            manifest.record(f"{script}:{filename}", fingerprint)
+    if all(successful):
+        manifest.record(f"{script}:shared", shared_fingerprints)
+    return all(successful)
+
+
+def main(workers: int = None, force: bool = False):
+    if not os.path.exists(OUTPUT_FOLDER_NAME):
+        os.mkdir(OUTPUT_FOLDER_NAME)
+
+    manifest = Manifest()
+
+    for stage in STAGES:
+        script = stage["script"]
+        if script == "1_extract_images.py":
+            if not extract_images(stage, manifest, workers, force):
+                print(f"ERROR: {script} failed. Stopping.")
+                return False
+            continue
+
+        fingerprints = manifest.fingerprints(script, get_inputs(stage) + [script])
+        outputs_exist = all(os.path.exists(output) for output in stage["outputs"])
+        if not force and outputs_exist and not manifest.is_changed(script, fingerprints):
+            print(f"Skipping {script} since its inputs haven't changed.")
+            continue
+
+        args = ["--workers", str(workers)] if script == "2_analyse_images.py" and workers is not None else []
+        if not run_script(script, *args):
+            print(f"ERROR: {script} failed. Stopping.")
+            return False
+
+        # Replace (rather than update) the fingerprints so that deleted inputs count as a change
+        manifest.stages[script] = {}
+        manifest.record(script, fingerprints)
+
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs every stage of the pipeline which is out of date.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of subjects processed at a time (defaults to the number of cores)")
+    parser.add_argument("--force", action="store_true", help="run every stage even if its inputs haven't changed")
+    args = parser.parse_args()
+    if not main(args.workers, args.force):
+        sys.exit(1)
@@ -1,8 +1,21 @@
 PDFS_FOLDER_NAME = "pdfs"
+PDF_INDEX_FOLDER_NAME = f"{PDFS_FOLDER_NAME}/index"
 EXTRACT_ALL_IMAGES = False
 
+# Whether run_pipeline.py runs fbcnn.py, which converts the charts extracted as JPEGs into PNGs (needs torch
+# and the FBCNN repository to clean any). Only JPEGs with a lower estimated quality than the threshold are cleaned
+DENOISE_IMAGES = False
+FBCNN_MODEL_PATH = "model_zoo/fbcnn_color.pth"
+FBCNN_QUALITY_THRESHOLD = 90
+
 IMAGES_FOLDER_NAME = "images"
 DEBUG_FOLDER_NAME = "debug"
 OUTPUT_FOLDER_NAME = "output"
+SHARDS_FOLDER_NAME = f"{OUTPUT_FOLDER_NAME}/shards"
 
 JSON_DATA_NAME = "data"
+VALIDATION_REPORT_NAME = "validation"
+DISTRIBUTION_STORE_NAME = "distributions"
+
+CACHE_FOLDER_NAME = "cache"
+CACHE_MAX_ENTRIES = 20000   # least recently used results are evicted past this many images
@@ -0,0 +1,125 @@
+"""
+Splits the analysis of the subject folders into shards which can be run separately (by different processes or
+machines) and merged into the same data as a single run. Each shard is written to its own file in SHARDS_FOLDER_NAME
+in one step, so a shard file only exists if the whole shard finished, and any shard which failed can be run again.
+Each shard file records the hash of its inputs, so a shard is only reused while its subjects and charts are unchanged.
+"""
+import os
+import zlib
+import json
+import hashlib
+from settings import SHARDS_FOLDER_NAME
+
+
+def get_shard(subject_folder: str, number_of_shards: int) -> int:
+    """Gets the shard a subject belongs to (a stable hash, unlike hash(), so every process agrees)"""
+    return zlib.crc32(subject_folder.encode()) % number_of_shards
+
+
+def get_shard_name(shard: int = None, number_of_shards: int = None, subjects: list = None) -> str:
+    """Gets the name of a shard, either from its number or from the explicit list of subjects in it"""
+    if subjects is not None:
+        return "subjects-" + hashlib.sha256(json.dumps(sorted(subjects)).encode()).hexdigest()[:12]
+    return f"shard-{shard:03}-of-{number_of_shards:03}"
+
+
+def select_subjects(subject_folders: list, shard: int = None, number_of_shards: int = None,
+                    subjects: list = None) -> list:
+    """Gets the subject folders in a shard, either by hash or from an explicit list of subjects"""
+    if subjects is not None:
+        subjects = set(subjects)
+        return [subject_folder for subject_folder in subject_folders if subject_folder in subjects]
+    return [subject_folder for subject_folder in subject_folders
+            if get_shard(subject_folder, number_of_shards) == shard]
+
+
+def get_shard_filename(name: str) -> str:
+    return f"{SHARDS_FOLDER_NAME}/{name}.json"
+
+
+def get_inputs_hash(filenames: list, settings: list) -> str:
+    """
+    Hashes the inputs of a shard: the size and modification time of each file it reads (like the manifest of
+    run_pipeline.py, so that nothing has to be read) and any settings which affect the results
+    """
+    inputs = [settings]
+    for filename in sorted(filenames):
+        stat = os.stat(filename)
+        inputs.append([filename, stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
+
+
+def is_shard_current(name: str, subject_folders: list, inputs_hash: str) -> bool:
+    """Whether a shard file exists and was written from the same subjects and inputs"""
+    try:
+        with open(get_shard_filename(name)) as file:
+            shard = json.load(file)
+    except (OSError, ValueError):
+        return False
+    return shard.get("subjects") == subject_folders and shard.get("inputs_hash") == inputs_hash
+
+
+def write_shard(name: str, subject_folders: list, data: dict, checks: dict, errors: list, inputs_hash: str = None):
+    """
+    Writes the data (and the checks used by validation.py) of the subjects in a shard,
+    along with the subjects it was responsible for
+    (so that subjects without any data can be told apart from subjects that no shard analysed)
+    and the hash of its inputs (see get_inputs_hash).
+    """
+    if not os.path.exists(SHARDS_FOLDER_NAME):
+        os.makedirs(SHARDS_FOLDER_NAME, exist_ok=True)
+
+    filename = get_shard_filename(name)
+    with open(f"{filename}.tmp", 'w') as file:
+        json.dump({
+            "subjects": subject_folders,
+            "inputs_hash": inputs_hash,
+            "data": data,
+            "checks": checks,
+            "errors": [[image_filename, f"{type(error).__name__}: {error}"] for image_filename, error in errors],
+        }, file, indent=4)
+    # Replace the old file in one step so that a shard file is never half-written
+    os.replace(f"{filename}.tmp", filename)
+
+
+def merge_shards(filenames: list, subject_folders: list, data_types: list):
+    """
+    Merges shard files into the data of every subject (in the same order as a single run).
+    Returns the data, the checks of every chart,
+    a list of (image filename, error message) of the charts which the shards couldn't analyse
+    and a list of problems: subjects or charts found in more than one shard, and subjects which aren't in any shard.
+    """
+    shards = {}
+    for filename in sorted(filenames):
+        with open(filename) as file:
+            shards[filename] = json.load(file)
+
+    problems = []
+    owners = {}     # dict mapping subject folder to the shard which analysed it
+    for filename, shard in shards.items():
+        for subject_folder in shard["subjects"]:
+            if subject_folder in owners:
+                problems.append(f"Subject {subject_folder} is in both {owners[subject_folder]} and {filename}")
+            else:
+                owners[subject_folder] = filename
+
+    for subject_folder in subject_folders:
+        if subject_folder not in owners:
+            problems.append(f"Subject {subject_folder} is not in any shard")
+
+    data = {data_type: {} for data_type in data_types}
+    checks = {data_type: {} for data_type in data_types}
+    errors = []
+    for filename, shard in shards.items():
+        errors.extend(shard["errors"])
+        for data_type, subjects in shard.get("checks", {}).items():
+            checks[data_type].update(subjects)
+        for data_type, subjects in shard["data"].items():
+            for subject_folder, score_lookup in subjects.items():
+                if subject_folder in data[data_type]:
+                    problems.append(f"{data_type} of subject {subject_folder} is in more than one shard")
+                data[data_type][subject_folder] = score_lookup
+
+    # Sorted so that the merged data is in the same order as a single run
+    data = {data_type: dict(sorted(subjects.items())) for data_type, subjects in data.items()}
+    return data, checks, errors, problems
@@ -0,0 +1,69 @@
+"""
+Registry of every subject in subjects.csv (code, short name, full name and whether it is a math/science subject).
+It is compiled into a pickle in CACHE_FOLDER_NAME the first time it is used, and only rebuilt when subjects.csv
+or MATH_SCIENCE_SUBJECTS change, so scripts don't each parse the CSV again.
+"""
+import os
+import csv
+import pickle
+import functools
+from constants import MATH_SCIENCE_SUBJECTS
+from settings import CACHE_FOLDER_NAME
+
+SUBJECTS_FILENAME = "subjects.csv"
+REGISTRY_FILENAME = f"{CACHE_FOLDER_NAME}/subjects.pickle"
+
+
+def get_fingerprint() -> list:
+    """Identifies the inputs of the registry, so that it is rebuilt whenever they change"""
+    stat = os.stat(SUBJECTS_FILENAME)
+    return [stat.st_size, stat.st_mtime_ns, sorted(MATH_SCIENCE_SUBJECTS)]
+
+
+def build_registry() -> dict:
+    codes = {}          # dict mapping short name (e.g. accounting) to subject code
+    names = {}          # dict mapping subject code to full name (e.g. Accounting)
+    math_science = {}   # dict mapping subject code to full name, for the math/science subjects only
+    with open(SUBJECTS_FILENAME) as file:
+        reader = csv.reader(file)
+        for row in reader:
+            subject_code, short_name, name = row[0], row[1], row[2]
+            codes[short_name] = subject_code
+            names[subject_code] = name
+            if short_name in MATH_SCIENCE_SUBJECTS:
+                math_science[subject_code] = name
+    return {"codes": codes, "names": names, "math_science": math_science}
+
+
+@functools.lru_cache()
+def get_registry() -> dict:
+    """Loads the compiled registry, rebuilding it if it is missing or out of date"""
+    fingerprint = get_fingerprint()
+    if os.path.exists(REGISTRY_FILENAME):
+        with open(REGISTRY_FILENAME, 'rb') as file:
+            cached = pickle.load(file)
+        if cached["fingerprint"] == fingerprint:
+            return cached["registry"]
+
+    registry = build_registry()
+    if not os.path.exists(CACHE_FOLDER_NAME):
+        os.makedirs(CACHE_FOLDER_NAME, exist_ok=True)
+    with open(f"{REGISTRY_FILENAME}.tmp", 'wb') as file:
+        pickle.dump({"fingerprint": fingerprint, "registry": registry}, file)
+    os.replace(f"{REGISTRY_FILENAME}.tmp", REGISTRY_FILENAME)
+    return registry
+
+
+def get_subject_codes() -> dict:
+    """Gets a dict mapping the short name of each subject (e.g. accounting) to its code"""
+    return get_registry()["codes"]
+
+
+def get_subject_names() -> dict:
+    """Gets a dict mapping the code of each subject to its full name (e.g. Accounting)"""
+    return get_registry()["names"]
+
+
+def get_math_science_subjects() -> dict:
+    """Gets a dict mapping the code of each math/science subject to its full name"""
+    return get_registry()["math_science"]
@@ -0,0 +1,127 @@
+"""
+Scores every parsed chart for signs that it was parsed wrongly, all charts of a data type at once,
+so that only the most suspicious charts need checking by hand (e.g. with ImageParser.DEBUG).
+Each check is scaled by its threshold in ANOMALY_THRESHOLDS, so a check scoring 1 or more is suspicious on its own,
+and the charts are ranked by the sum of their checks.
+"""
+import json
+import numpy as np
+from constants import ANOMALY_THRESHOLDS, TOTAL_MARKS
+
+
+def get_percentages(subjects: dict) -> np.ndarray:
+    """Stacks the score lookups of a data type into one array (padded with NaN), indexed by [chart, raw score]"""
+    lengths = [len(score_lookup) for score_lookup in subjects.values()]
+    percentages = np.full((len(subjects), max(lengths, default=0)), np.nan)
+    for row, score_lookup in enumerate(subjects.values()):
+        percentages[row, :lengths[row]] = list(score_lookup.values())
+    return percentages
+
+
+def count_interior_zeros(percentages: np.ndarray) -> np.ndarray:
+    """
+    Counts the empty bars between the first and last non-empty bar of each chart.
+    Empty bars at either end are expected (e.g. nobody getting full marks), but not in the middle.
+    """
+    non_zero = percentages > 0
+    raw_scores = np.arange(percentages.shape[1])
+    first = non_zero.argmax(axis=1)
+    last = percentages.shape[1] - 1 - non_zero[:, ::-1].argmax(axis=1)
+    interior = (raw_scores > first[:, None]) & (raw_scores < last[:, None])
+    return (interior & (percentages == 0)).sum(axis=1)
+
+
+def get_mean_marks(percentages: np.ndarray, data_type: str) -> np.ndarray:
+    """Gets the mean mark of each chart. Each Total bar covers TOTAL_MARKS / (number of bars - 1) marks"""
+    raw_scores = np.arange(percentages.shape[1])
+    marks = np.broadcast_to(raw_scores, percentages.shape).astype(float)
+    if data_type == "Total":
+        lengths = (~np.isnan(percentages)).sum(axis=1)
+        marks = marks * (TOTAL_MARKS / np.maximum(lengths - 1, 1))[:, None]
+    return np.nansum(percentages * marks, axis=1) / np.nansum(percentages, axis=1)
+
+
+def get_year_divergence(percentages: np.ndarray, subject_folders: list) -> np.ndarray:
+    """
+    Gets the largest difference between the cumulative distribution of each chart
+    and the mean of the same subject's charts (with the same number of bars) in every other year.
+    Subjects with only one year have nothing to compare against so score 0.
+    """
+    lengths = (~np.isnan(percentages)).sum(axis=1)
+    groups = [f"{subject_folder[:-3]}/{length}" for subject_folder, length in zip(subject_folders, lengths)]
+    _, group_ids, group_sizes = np.unique(groups, return_inverse=True, return_counts=True)
+    group_ids = group_ids.reshape(-1)
+
+    cumulative = np.cumsum(np.nan_to_num(percentages), axis=1)
+    group_sums = np.zeros((len(group_sizes), cumulative.shape[1]))
+    np.add.at(group_sums, group_ids, cumulative)
+
+    others = group_sizes[group_ids] - 1
+    has_others = others > 0
+    other_means = (group_sums[group_ids] - cumulative) / np.maximum(others, 1)[:, None]
+    divergence = np.abs(cumulative - other_means).max(axis=1, initial=0)
+    return np.where(has_others, divergence, 0)
+
+
+def score_charts(data: dict, checks: dict = None) -> list:
+    """
+    Scores every chart in the data (data type -> subject folder -> score lookup).
+    checks is the per-chart measurements recorded while parsing (data type -> subject folder -> {"tick_spacing": ...}).
+    Returns a list of {"data_type", "subject", "score", "checks"} ranked from most to least suspicious.
+    """
+    checks = checks or {}
+    means = {}      # dict mapping data type to dict mapping subject folder to mean mark
+    report = []
+    for data_type, subjects in data.items():
+        if not subjects:
+            continue
+        subject_folders = list(subjects)
+        percentages = get_percentages(subjects)
+        totals = np.nansum(percentages, axis=1)
+        means[data_type] = dict(zip(subject_folders, get_mean_marks(percentages, data_type).tolist()))
+
+        tick_spacings = np.array([checks.get(data_type, {}).get(subject_folder, {}).get("tick_spacing")
+                                  for subject_folder in subject_folders], dtype=float)
+        values = {
+            "tick_spacing": np.nan_to_num(tick_spacings),
+            "interior_zero_bars": count_interior_zeros(percentages),
+            # The percentages are normalised when parsed, so this only catches charts with no (or broken) bars
+            "percentage_total": np.abs(np.nan_to_num(totals) - 1),
+            "year_divergence": get_year_divergence(percentages, subject_folders),
+            "total_mismatch": np.zeros(len(subject_folders)),
+        }
+        for row, subject_folder in enumerate(subject_folders):
+            report.append({
+                "data_type": data_type,
+                "subject": subject_folder,
+                "checks": {check: float(check_values[row]) for check, check_values in values.items()},
+            })
+
+    # The mean total must be the mean internal plus the mean external, whatever the correlation between them
+    for entry in report:
+        subject_means = [means.get(data_type, {}).get(entry["subject"]) for data_type in
+                         ["Internals", "Externals", "Total"]]
+        if None not in subject_means:
+            internals, externals, total = subject_means
+            entry["checks"]["total_mismatch"] = abs(total - (internals + externals)) / TOTAL_MARKS
+
+    for entry in report:
+        entry["score"] = sum(value / ANOMALY_THRESHOLDS[check] for check, value in entry["checks"].items())
+    return sorted(report, key=lambda entry: entry["score"], reverse=True)
+
+
+def write_report(filename: str, report: list, number_shown: int = 10):
+    """Writes the ranked report as JSON and prints the most suspicious charts"""
+    with open(filename, 'w') as file:
+        json.dump(report, file, indent=4)
+
+    suspicious = [entry for entry in report
+                  if any(value >= ANOMALY_THRESHOLDS[check] for check, value in entry["checks"].items())]
+    if suspicious:
+        print(f"WARNING: {len(suspicious)} of {len(report)} chart(s) look suspicious. "
+              f"The {min(number_shown, len(suspicious))} most suspicious:")
+        for entry in suspicious[:number_shown]:
+            failed = ", ".join(f"{check} {value:.3g}" for check, value in entry["checks"].items()
+                               if value >= ANOMALY_THRESHOLDS[check])
+            print(f"    {entry['score']:8.2f}  {entry['data_type']} of {entry['subject']} ({failed})")
+    print(f"Wrote the anomaly score of each chart to {filename}")